@@ -0,0 +1,69 @@
+"""
+Throughput of chunker.chunk_text against the old chunk_text_with_overlap,
+on the text of already downloaded PDFs.
+
+    python -m src.ingestion.benchmark_chunker --pdfs data/raw --limit 50
+"""
+import argparse
+import glob
+import os
+import time
+
+from src.ingestion.preprocess import extract_pdf, clean_text, chunk_text_with_overlap
+from src.ingestion.chunker import chunk_text, get_tokenizer, CHUNK_MAX_TOKENS, CHUNK_OVERLAP
+
+# all-MiniLM-L6-v2 max_seq_length, special tokens included
+MODEL_MAX_TOKENS=256
+
+
+def load_texts(pdf_dir, limit):
+    texts=[]
+    for path in sorted(glob.glob(os.path.join(pdf_dir,"*.pdf")))[:limit]:
+        _, text = extract_pdf(path)
+        text=clean_text(text)
+        if text:
+            texts.append(text)
+    return texts
+
+
+def truncated_share(chunks):
+    """
+    Share of chunks the embedding model would silently cut off
+    """
+    tokenizer=get_tokenizer()
+    lengths=[len(e.ids) for e in tokenizer.encode_batch(chunks, add_special_tokens=True)]
+    return sum(l>MODEL_MAX_TOKENS for l in lengths)/max(len(lengths),1)
+
+
+def bench(name, chunk_fn, texts, repeat):
+    total_mb=sum(len(t.encode("utf-8")) for t in texts)/1e6
+    best=float("inf")
+    for _ in range(repeat):
+        start=time.perf_counter()
+        chunks=[c for t in texts for c in chunk_fn(t)]
+        best=min(best,time.perf_counter()-start)
+
+    print(f"{name:<26} {best:8.3f}s  {total_mb/best:7.2f} MB/s  {len(chunks):6d} chunks  "
+          f"{truncated_share(chunks):6.1%} truncated at embed time")
+
+
+def main():
+    parser=argparse.ArgumentParser()
+    parser.add_argument("--pdfs", default="data/raw")
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=3)
+    args=parser.parse_args()
+
+    texts=load_texts(args.pdfs,args.limit)
+    if not texts:
+        print(f"❌ No readable PDFs in {args.pdfs}")
+        return
+    print(f"{len(texts)} documents, {sum(map(len,texts))/1e6:.1f}M characters")
+
+    get_tokenizer()  # keep model loading out of the timings
+    bench("chunk_text_with_overlap", lambda t: chunk_text_with_overlap(t,350,50), texts, args.repeat)
+    bench("chunk_text", lambda t: chunk_text(t,CHUNK_MAX_TOKENS,CHUNK_OVERLAP), texts, args.repeat)
+
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+Columnar on-disk chunk store, one directory per corpus:
+
+    text.bin     UTF-8 text of every chunk, back to back
+    chunks.bin   one fixed-size row per chunk (CHUNK_DTYPE), byte range into text.bin
+    papers.json  paper table: metadata copied once per paper, first row and row count
+    meta.json    counts and the latest date_published, readable without the rest
+
+Chunks of a paper are contiguous, so a paper is one slice of the row table.
+"""
+import json
+import mmap
+import os
+
+import numpy as np
+
+from src.ingestion import staged_dir
+
+STORE_VERSION=1
+
+CHUNK_DTYPE=np.dtype([
+    ("start", "<u8"),
+    ("end", "<u8"),
+    ("paper", "<u4"),
+    ("chunk_index", "<u4"),
+    ("n_tokens", "<u4"),
+    ("is_abstract", "?"),
+])
+
+PAPER_FIELDS=("source_id","title","authors","doi","domain","citation_count","date_published")
+
+
+def exists(path):
+    return os.path.exists(os.path.join(path,"meta.json"))
+
+
+def read_meta(path):
+    with open(os.path.join(path,"meta.json"),"r",encoding="utf-8") as f:
+        return json.load(f)
+
+
+def read_latest_date(path):
+    """
+    Latest date_published in the store, without opening the chunks
+    """
+    return read_meta(path).get("latest_date")
+
+
+def chunk_id(source_id,chunk_index):
+    return f"{source_id}_chunk_{chunk_index}"
+
+
+class ChunkStoreWriter:
+    """
+    Appends papers to <path>.tmp and swaps it in place of path on commit()
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = staged_dir.start(path)
+        self.text_f = open(os.path.join(self.tmp_path, "text.bin"), "wb")
+        self.rows_f = open(os.path.join(self.tmp_path, "chunks.bin"), "wb")
+        self.papers = []
+        self.n_chunks = 0
+
+    def _add_paper_row(self, metadata, n_chunks, fingerprint):
+        paper = {k: metadata.get(k) for k in PAPER_FIELDS}
+        paper.update({"first_chunk": self.n_chunks, "n_chunks": n_chunks, "fingerprint": fingerprint})
+        self.papers.append(paper)
+        self.n_chunks += n_chunks
+
+    def add_paper(self, metadata, chunks, fingerprint=None):
+        """
+        chunks: list of (text, chunk_index, is_abstract, n_tokens)
+        """
+        rows = np.zeros(len(chunks), dtype=CHUNK_DTYPE)
+        offset = self.text_f.tell()
+        for row, (text, chunk_index, is_abstract, n_tokens) in zip(rows, chunks):
+            data = text.encode("utf-8")
+            self.text_f.write(data)
+            row["start"], row["end"] = offset, offset + len(data)
+            row["paper"], row["chunk_index"] = len(self.papers), chunk_index
+            row["n_tokens"], row["is_abstract"] = n_tokens, is_abstract
+            offset += len(data)
+        rows.tofile(self.rows_f)
+        self._add_paper_row(metadata, len(chunks), fingerprint)
+
+    def copy_paper(self, store, source_id, metadata=None, fingerprint=None):
+        """
+        Copy a paper's chunks from another store without decoding them
+        """
+        paper = store.papers[store.paper_index[source_id]]
+        rows = np.array(store.rows[paper["first_chunk"]:paper["first_chunk"] + paper["n_chunks"]])
+        if len(rows):
+            begin, end = int(rows["start"][0]), int(rows["end"][-1])
+            offset = self.text_f.tell()
+            self.text_f.write(store.text[begin:end])
+            rows["start"] = rows["start"] - begin + offset
+            rows["end"] = rows["end"] - begin + offset
+        rows["paper"] = len(self.papers)
+        rows.tofile(self.rows_f)
+        self._add_paper_row(metadata or paper, len(rows), fingerprint or paper["fingerprint"])
+
+    def commit(self):
+        self.text_f.close()
+        self.rows_f.close()
+
+        dates = [p["date_published"] for p in self.papers if p.get("date_published")]
+        meta = {
+            "version": STORE_VERSION,
+            "n_papers": len(self.papers),
+            "n_chunks": self.n_chunks,
+            "latest_date": max(dates) if dates else None,
+        }
+        with open(os.path.join(self.tmp_path, "papers.json"), "w", encoding="utf-8") as f:
+            json.dump(self.papers, f, ensure_ascii=False)
+        staged_dir.commit(self.tmp_path, self.path, meta)
+
+    def abort(self):
+        self.text_f.close()
+        self.rows_f.close()
+        staged_dir.abort(self.tmp_path)
+
+
+class ChunkStore:
+    """
+    Read side: memory-maps the text blob and the row table
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.meta = read_meta(path)
+        with open(os.path.join(path, "papers.json"), "r", encoding="utf-8") as f:
+            self.papers = json.load(f)
+        self.paper_index = {p["source_id"]: i for i, p in enumerate(self.papers)}
+
+        if self.meta["n_chunks"]:
+            self.rows = np.memmap(os.path.join(path, "chunks.bin"), dtype=CHUNK_DTYPE, mode="r")
+            self._text_f = open(os.path.join(path, "text.bin"), "rb")
+            self.text = mmap.mmap(self._text_f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.rows = np.zeros(0, dtype=CHUNK_DTYPE)
+            self._text_f = None
+            self.text = b""
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._text_f is not None:
+            self.text.close()
+            self._text_f.close()
+            self._text_f = None
+        self.rows = None
+
+    def chunk_text(self, i):
+        row = self.rows[i]
+        return self.text[int(row["start"]):int(row["end"])].decode("utf-8")
+
+    def paper(self, source_id):
+        return self.papers[self.paper_index[source_id]]
+
+    def paper_rows(self, source_id):
+        """
+        Row numbers of a paper's chunks
+        """
+        paper = self.paper(source_id)
+        return range(paper["first_chunk"], paper["first_chunk"] + paper["n_chunks"])
+
+    def paper_chunks(self, source_id):
+        return [self.chunk_text(i) for i in self.paper_rows(source_id)]
+
+    def iter_batches(self, batch_size=50):
+        """
+        Yield column batches: row numbers, ids, texts and the row columns.
+        Paper fields are looked up in self.papers through the "paper" column.
+        """
+        for begin in range(0, len(self.rows), batch_size):
+            rows = np.array(self.rows[begin:begin + batch_size])
+            yield {
+                "rows": range(begin, begin + len(rows)),
+                "ids": [chunk_id(self.papers[p]["source_id"], c) for p, c in zip(rows["paper"], rows["chunk_index"])],
+                "texts": [self.text[int(s):int(e)].decode("utf-8") for s, e in zip(rows["start"], rows["end"])],
+                "paper": rows["paper"],
+                "chunk_index": rows["chunk_index"],
+                "n_tokens": rows["n_tokens"],
+                "is_abstract": rows["is_abstract"],
+            }
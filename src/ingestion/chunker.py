@@ -0,0 +1,102 @@
+import re
+from bisect import bisect_right
+
+import yaml
+from tokenizers import Tokenizer
+
+with open("config.yaml","r") as f:
+    config=yaml.safe_load(f)
+
+preprocess_config=config.get("preprocess",{})
+EMBEDDING_MODEL=config.get("embedding",{}).get("model","sentence-transformers/all-MiniLM-L6-v2")
+
+# Bump when chunk boundaries change so cached chunks get rebuilt
+CHUNKER_VERSION="wordpiece-spans-3"
+
+# all-MiniLM-L6-v2 truncates at 256 wordpieces, [CLS] and [SEP] included
+CHUNK_MAX_TOKENS=preprocess_config.get("chunk_max_tokens",254)
+CHUNK_OVERLAP=preprocess_config.get("chunk_overlap",32)
+
+# End of a sentence: punctuation, optional closing quote/bracket, whitespace
+SENTENCE_END=re.compile(r"[.!?][\"')\]]?\s")
+
+_tokenizer=None
+
+
+def get_tokenizer():
+    """
+    The embedding model's own tokenizer, loaded once per process
+    """
+    global _tokenizer
+    if _tokenizer is None:
+        _tokenizer=Tokenizer.from_pretrained(EMBEDDING_MODEL)
+        _tokenizer.no_truncation()
+        _tokenizer.no_padding()
+    return _tokenizer
+
+
+def chunk_spans(text: str, max_tokens: int = CHUNK_MAX_TOKENS, overlap: int = CHUNK_OVERLAP, tokenizer=None):
+    """
+    Split text into overlapping windows of at most max_tokens wordpieces of
+    the embedding tokenizer. Returns (start, end, n_tokens) character ranges
+    into text, so chunks are plain slices of the one buffer.
+
+    A window ends at the last sentence end in its second half when there is
+    one, and windows do not start or end inside a word unless the word is
+    longer than half a window (unspaced PDF text, URLs, formulas), which is
+    cut like any token run.
+    """
+    tokenizer=tokenizer or get_tokenizer()
+    offsets=tokenizer.encode(text, add_special_tokens=False).offsets
+    n=len(offsets)
+    if n==0:
+        return []
+
+    starts=[o[0] for o in offsets]
+
+    def word_start(j,floor):
+        # move j back while token j continues the previous token's word; a
+        # word reaching back to floor (unspaced text, URLs, formulas) is cut at j
+        k=j
+        while k>floor and offsets[k][0]==offsets[k-1][1]:
+            k-=1
+        return k if k>floor else j
+
+    # token index right after each sentence end
+    boundaries=[bisect_right(starts, m.end()-1) for m in SENTENCE_END.finditer(text)]
+
+    spans=[]
+    i=0
+    while True:
+        j=min(i+max_tokens, n)
+        if j<n:
+            k=bisect_right(boundaries, j)-1
+            if k>=0 and boundaries[k]>i+max_tokens//2:
+                j=boundaries[k]
+            else:
+                j=word_start(j, i+max_tokens//2)
+        spans.append((offsets[i][0], offsets[j-1][1], j-i))
+        if j>=n:
+            return spans
+        # step back for the overlap, always making progress
+        i=max(word_start(j-overlap, i+1) if overlap>0 else j, i+1)
+
+
+def truncate_text(text: str, max_tokens: int = CHUNK_MAX_TOKENS):
+    """
+    (prefix, n_tokens): the first window chunk_spans would cut, for text
+    that has to stay one chunk
+    """
+    spans=chunk_spans(text, max_tokens, 0)
+    if not spans:
+        return "", 0
+    _, end, n_tokens = spans[0]
+    return text[:end], n_tokens
+
+
+def count_tokens(text: str) -> int:
+    return len(get_tokenizer().encode(text, add_special_tokens=False).ids)
+
+
+def chunk_text(text: str, max_tokens: int = CHUNK_MAX_TOKENS, overlap: int = CHUNK_OVERLAP):
+    return [text[start:end] for start, end, _ in chunk_spans(text, max_tokens, overlap)]
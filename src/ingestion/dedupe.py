@@ -0,0 +1,189 @@
+"""
+Near-duplicate detection over the chunk stores, run between preprocessing
+and embedding. Every chunk gets a MinHash signature of its word shingles and
+LSH buckets propose candidates, which are kept when the estimated Jaccard
+similarity reaches the threshold.
+
+A paper is a duplicate of another one (preprint vs published version, same
+work under two OpenAlex ids) when its title + abstract chunk matches the
+other's, or when most of its chunks do; all its chunks are then dropped.
+Otherwise single chunks that match an earlier chunk are dropped.
+
+Earlier chunks win: the high-citation store is scanned before the recent one.
+The kept chunks record which papers their dropped copies came from, see
+duplicate_sources.
+"""
+import json
+import os
+import re
+import zlib
+from collections import Counter
+
+import numpy as np
+import yaml
+
+from src.ingestion import chunk_store
+from src.ingestion.chunk_store import ChunkStore, chunk_id
+
+with open("config.yaml","r") as f:
+    config=yaml.safe_load(f)
+
+dedupe_config=config.get("dedupe",{})
+
+DUPLICATES_PATH="data/processed/duplicates.json"
+
+THRESHOLD=dedupe_config.get("threshold",0.85)
+NUM_PERM=dedupe_config.get("num_perm",128)
+BANDS=dedupe_config.get("bands",16)
+SHINGLE_SIZE=dedupe_config.get("shingle_size",5)
+PAPER_DUPLICATE_SHARE=dedupe_config.get("paper_duplicate_share",0.8)
+
+# Largest prime below 2**32: hashes stay in uint32, products in uint64
+PRIME=np.uint64(4294967291)
+_rng=np.random.default_rng(1)
+_A=_rng.integers(1,2**32-5,NUM_PERM,dtype=np.uint64)
+_B=_rng.integers(0,2**32-5,NUM_PERM,dtype=np.uint64)
+
+WORD=re.compile(r"\w+")
+
+
+def shingle_hashes(text):
+    words=WORD.findall(text.lower())
+    if len(words)<SHINGLE_SIZE:
+        shingles=[" ".join(words)]
+    else:
+        shingles=[" ".join(words[i:i+SHINGLE_SIZE]) for i in range(len(words)-SHINGLE_SIZE+1)]
+    return np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+
+
+def minhash(text):
+    hashes=shingle_hashes(text)
+    return ((hashes[:,None]*_A+_B)%PRIME).min(axis=0).astype(np.uint32)
+
+
+def similarity(sig_a,sig_b):
+    """
+    Estimated Jaccard similarity of two signatures
+    """
+    return float(np.mean(sig_a==sig_b))
+
+
+def source_of(cid):
+    return cid.rsplit("_chunk_",1)[0]
+
+
+class LSHIndex:
+    def __init__(self, num_perm=NUM_PERM, bands=BANDS):
+        self.rows = num_perm // bands
+        self.bands = bands
+        self.buckets = [{} for _ in range(bands)]
+        self.signatures = {}
+
+    def _keys(self, sig):
+        for band in range(self.bands):
+            yield band, hash(sig[band*self.rows:(band+1)*self.rows].tobytes())
+
+    def query(self, sig, threshold=THRESHOLD):
+        """
+        Id of the indexed chunk most similar to sig, or None below threshold
+        """
+        best, best_similarity = None, threshold
+        checked = set()
+        for band, key in self._keys(sig):
+            for candidate in self.buckets[band].get(key, ()):
+                if candidate in checked:
+                    continue
+                checked.add(candidate)
+                score = similarity(sig, self.signatures[candidate])
+                if score >= best_similarity and (best is None or score > best_similarity):
+                    best, best_similarity = candidate, score
+        return best
+
+    def insert(self, cid, sig):
+        self.signatures[cid] = sig
+        for band, key in self._keys(sig):
+            self.buckets[band].setdefault(key, []).append(cid)
+
+
+def find_duplicates(store_paths):
+    """
+    Returns {"chunks": {chunk_id: canonical_chunk_id}, "papers": {source_id: canonical_source_id}}
+    """
+    index=LSHIndex()
+    duplicates={"chunks": {}, "papers": {}}
+    seen=set()
+
+    for path in store_paths:
+        if not chunk_store.exists(path):
+            continue
+        with ChunkStore(path) as store:
+            for paper in store.papers:
+                source_id=paper["source_id"]
+                # same work in both stores, it is stored under the same ids anyway
+                if source_id in seen:
+                    continue
+                seen.add(source_id)
+
+                chunks=[]
+                for row in store.paper_rows(source_id):
+                    cid=chunk_id(source_id,int(store.rows[row]["chunk_index"]))
+                    sig=minhash(store.chunk_text(row))
+                    match=index.query(sig)
+                    chunks.append((cid,sig,match,bool(store.rows[row]["is_abstract"])))
+
+                # Paper level: abstract match or most chunks pointing at one paper
+                targets=Counter(source_of(m) for _,_,m,_ in chunks if m is not None)
+                abstract_match=next((m for _,_,m,a in chunks if a and m is not None and m.endswith("_chunk_0")),None)
+                target=None
+                if abstract_match is not None:
+                    target=source_of(abstract_match)
+                elif targets and chunks:
+                    best,count=targets.most_common(1)[0]
+                    if count/len(chunks)>=PAPER_DUPLICATE_SHARE:
+                        target=best
+
+                if target is not None and target!=source_id:
+                    duplicates["papers"][source_id]=target
+                    continue
+
+                for cid,sig,match,_ in chunks:
+                    if match is not None:
+                        duplicates["chunks"][cid]=match
+                    else:
+                        index.insert(cid,sig)
+
+    return duplicates
+
+
+def dedupe_chunks(store_paths=("data/processed/chunks","data/processed/chunks_recent"),out_path=DUPLICATES_PATH):
+    duplicates=find_duplicates(store_paths)
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    with open(out_path+".tmp","w",encoding="utf-8") as f:
+        json.dump(duplicates,f)
+    os.replace(out_path+".tmp",out_path)
+    print(f"🧹 {len(duplicates['papers'])} duplicate papers and {len(duplicates['chunks'])} duplicate chunks will be skipped")
+    return duplicates
+
+
+def load_duplicates(path=DUPLICATES_PATH):
+    if not os.path.exists(path):
+        return {"chunks": {}, "papers": {}}
+    with open(path,"r",encoding="utf-8") as f:
+        return json.load(f)
+
+
+def duplicate_sources(duplicates):
+    """
+    ({chunk_id: source_ids}, {source_id: source_ids}) of the papers whose
+    copies were dropped in favour of a kept chunk or a whole kept paper
+    """
+    by_chunk, by_paper = {}, {}
+    for cid, canonical in duplicates["chunks"].items():
+        by_chunk.setdefault(canonical, set()).add(source_of(cid))
+    for source_id, canonical in duplicates["papers"].items():
+        by_paper.setdefault(canonical, set()).add(source_id)
+    return by_chunk, by_paper
+
+
+if __name__=="__main__":
+    dedupe_chunks()
@@ -1,7 +1,5 @@
 from ast import List
-import requests
 import yaml
-from requests.adapters import HTTPAdapter
 import os 
 import re 
 from datetime import datetime, timedelta
@@ -9,42 +7,87 @@ import json
 from tqdm import tqdm 
 import time
 import arxiv
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from src.ingestion import http_client
+from src.ingestion.http_client import host_slot
+from src.ingestion import pdf_cache
+from src.ingestion import pdf_store
+from src.ingestion.journal import MetadataJournal, journal_path, read_journal
+import hashlib
 
 with open("config.yaml","r") as f:
     config=yaml.safe_load(f)
 
 all_domains=list(map(lambda x:x["id"],config["concepts"]))
+ingestion_config=config.get("ingestion",{})
+
+OPENALEX_MAX_PER_PAGE=200
+WATERMARKS_PATH="data/processed/openalex_watermarks.json"
+
+# arXiv asks for one request every 3 seconds, the client enforces it
+arxiv_client=arxiv.Client(page_size=3,delay_seconds=3,num_retries=3)
+
+# statuses that say nothing about the URL, only about the server right now
+TRANSIENT_STATUS=(408,429)
+
+# per thread: did the PDF resolution in progress hit a non-definitive answer
+_resolution=threading.local()
+
+def mark_inconclusive():
+    _resolution.inconclusive=True
 
 def is_pdf_url(url: str, timeout: int = 8) -> bool:
     """
-    Quick check if URL returns a PDF - streamlined version
+    Quick check if URL returns a PDF, answered from the PDF cache when the URL
+    (or its host / path pattern) was probed before
     """
     if not url:
         return False
-        
+
+    cached = pdf_cache.get_probe(url)
+    if cached is not None:
+        return cached
+    if pdf_cache.is_known_bad(url):
+        return False
+
+    ok = probe_pdf_url(url, timeout=timeout)
+    if ok is None:
+        # network trouble is not a property of the URL, so it is not cached
+        mark_inconclusive()
+        return False
+    pdf_cache.record_probe(url, ok)
+    return ok
+
+def is_transient(status_code):
+    return status_code in TRANSIENT_STATUS or status_code >= 500
+
+def probe_pdf_url(url: str, timeout: int = 8):
+    """
+    Quick check if URL returns a PDF - streamlined version.
+    Returns None instead of False when the answer is not definitive
+    (connection errors, timeouts, 429 / 5xx after the client's retries).
+    """
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        }
-        
         # Try HEAD first (fastest)
-        r = requests.head(url, allow_redirects=True, timeout=timeout, headers=headers)
+        r = http_client.head(url, timeout=timeout)
         if r.status_code == 200:
             ctype = r.headers.get("Content-Type", "").lower()
             if "pdf" in ctype:
                 return True
         
         # If HEAD unclear, try partial GET
-        headers['Range'] = 'bytes=0-100'
-        r = requests.get(url, headers=headers, timeout=timeout, allow_redirects=True)
+        r = http_client.get(url, headers={'Range': 'bytes=0-100'}, timeout=timeout)
         if r.status_code in [200, 206]:
             if r.content.startswith(b'%PDF'):
                 return True
+        elif is_transient(r.status_code):
+            return None
         
         return False
         
     except Exception:
-        return False
+        return None
 
 def safe_name(name):
     # Handle None or non-string values
@@ -142,7 +185,11 @@ def get_arxiv_link(work: dict):
             sort_by=arxiv.SortCriterion.Relevance
         )
         
-        for result in search.results():
+        with host_slot("https://export.arxiv.org"):
+            http_client.throttle("https://export.arxiv.org")
+            results = list(arxiv_client.results(search))
+
+        for result in results:
             # Simple word overlap check
             result_words = set(result.title.lower().split())
             query_words = set(title.lower().split())
@@ -152,7 +199,7 @@ def get_arxiv_link(work: dict):
                 return result.pdf_url
 
     except Exception:
-        pass
+        mark_inconclusive()
 
     return None
 
@@ -171,7 +218,7 @@ def get_semantic_scholar_pdf(work):
             'fields': 'openAccessPdf,title'
         }
         
-        response = requests.get(
+        response = http_client.get(
             "https://api.semanticscholar.org/graph/v1/paper/search",
             params=params, 
             timeout=8
@@ -190,9 +237,11 @@ def get_semantic_scholar_pdf(work):
                         pdf_url = paper['openAccessPdf']['url']
                         if is_pdf_url(pdf_url):
                             return pdf_url
+        elif is_transient(response.status_code):
+            mark_inconclusive()
     
     except Exception:
-        pass
+        mark_inconclusive()
     
     return None
 
@@ -202,10 +251,7 @@ def get_remote_file_size(url, timeout=5):
     Returns size in bytes or None if not available.
     """
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        }
-        r = requests.head(url, allow_redirects=True, timeout=timeout, headers=headers)
+        r = http_client.head(url, timeout=timeout)
         if "Content-Length" in r.headers:
             return int(r.headers["Content-Length"])
     except Exception:
@@ -215,30 +261,41 @@ def get_remote_file_size(url, timeout=5):
 def download_pdf(pdf_url: str, name: str, out_dir="data/raw", 
                  max_size_mb=15, max_time=7, timeout=5):
     """
-    Downloads a PDF safely
+    Downloads a PDF safely into the content-addressed PDF store and exposes
+    it as <out_dir>/<name>.pdf. Works already in the store are not fetched
+    again, and known URLs are revalidated with ETag / Last-Modified.
     """
-    os.makedirs(out_dir, exist_ok=True)
-    filename = os.path.join(out_dir, name + ".pdf")
+    if pdf_store.has_source(name):
+        pdf_store.materialize(name, out_dir)
+        return "saved"
+
+    conditional = pdf_store.conditional_headers(pdf_url)
 
     # 1. Check remote file size
-    size = get_remote_file_size(pdf_url, timeout=timeout)
-    if size and size > max_size_mb * 1024 * 1024:
-        return "too_large"
+    if not conditional:
+        size = get_remote_file_size(pdf_url, timeout=timeout)
+        if size and size > max_size_mb * 1024 * 1024:
+            return "too_large"
 
     # 2. Download with streaming
+    tmp_path = pdf_store.temp_path()
     try:
         start = time.time()
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        }
-        with requests.get(pdf_url, stream=True, timeout=timeout, allow_redirects=True, headers=headers) as r:
+        with http_client.stream(pdf_url, timeout=timeout, headers=conditional) as r:
+            if r.status_code == 304:
+                pdf_store.link_url(name, pdf_url)
+                pdf_store.materialize(name, out_dir)
+                return "saved"
+
             r.raise_for_status()
             size_downloaded = 0
-            with open(filename, "wb") as f:
+            digest = hashlib.sha256()
+            with open(tmp_path, "wb") as f:
                 for chunk in r.iter_content(chunk_size=8192):
                     if not chunk:
                         break
                     f.write(chunk)
+                    digest.update(chunk)
                     size_downloaded += len(chunk)
 
                     if size_downloaded > max_size_mb * 1024 * 1024:
@@ -247,14 +304,22 @@ def download_pdf(pdf_url: str, name: str, out_dir="data/raw",
                     if time.time() - start > max_time:
                         return "timeout"
 
-        
+            pdf_store.add_file(tmp_path, digest.hexdigest(), name, pdf_url,
+                               etag=r.headers.get("ETag"), last_modified=r.headers.get("Last-Modified"))
+
+        pdf_store.materialize(name, out_dir)
         return "saved"
 
     except Exception as e:
         print(f"⚠️ Failed to download {pdf_url}: {e}")
         return "failed"
 
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
 papers_ids=set()
+papers_ids_lock=threading.Lock()
 
 def is_primary_concept(work,concept):
     needed_url=f"https://openalex.org/{str(concept)}"
@@ -264,16 +329,25 @@ def is_primary_concept(work,concept):
             return True if cur_concept["score"]>0.45 else False
     return False
 
-def fetch_paper_by_concept(id,domain,minimum_citations=400,max_results=1,recent_days=None,out_dir="data/raw"):
-    global papers_ids
+def fetch_concept_works(id,minimum_citations=400,max_results=None,recent_days=None,watermark=None):
+    """
+    Ask OpenAlex for the latest works tagged with a concept, following the
+    cursor until max_results works (None = no cap) or ingestion.max_pages.
+
+    If a watermark dict is given only works newer than it, plus the pending
+    works of earlier runs, are returned. It is advanced in place to the
+    newest work seen, and the returned works stay pending until the caller
+    settles them.
+    """
     base_url=config["sources"]["openalex"]["api_url"]
+    max_pages=ingestion_config.get("max_pages",25)
 
 
     if minimum_citations==0:
         params = {
             "filter": f"concepts.id:{id}",
             "sort": "publication_date:desc",
-            "per-page": max_results,
+            "per-page": min(max_results or OPENALEX_MAX_PER_PAGE, OPENALEX_MAX_PER_PAGE),
         }
 
 
@@ -281,75 +355,359 @@ def fetch_paper_by_concept(id,domain,minimum_citations=400,max_results=1,recent_
         params = {
             "filter": f"concepts.id:{id},cited_by_count:>{minimum_citations}",
             "sort": "publication_date:desc",
-            "per-page": max_results,
+            "per-page": min(max_results or OPENALEX_MAX_PER_PAGE, OPENALEX_MAX_PER_PAGE),
         }
 
+    date_limit=""
     if recent_days:
         date_limit = (datetime.today() - timedelta(days=recent_days)).strftime("%Y-%m-%d")
+
+    if watermark:
+        # works whose PDF was not stored yet are listed again until they leave the window
+        watermark["pending"]={i:d for i,d in watermark.get("pending",{}).items() if d>date_limit}
+    if watermark and watermark.get("publication_date","") > date_limit:
+        since=min([watermark["publication_date"]]+list(watermark["pending"].values()))
+        # inclusive, works already handled are filtered by id below
+        params["filter"] += f",from_publication_date:{since}"
+    elif date_limit:
         params["filter"] += f",publication_date:>{date_limit}"
 
+    # Joining the polite pool only needs a contact email
+    if config["sources"]["openalex"].get("mailto"):
+        params["mailto"]=config["sources"]["openalex"]["mailto"]
+
+    works=[]
+    params["cursor"]="*"
+    for _ in range(max_pages):
+        response=http_client.get(base_url,params=params,timeout=30).json()
+        results=response.get("results", [])
+        works.extend(results)
+
+        next_cursor=response.get("meta",{}).get("next_cursor")
+        if not results or not next_cursor or (max_results and len(works)>=max_results):
+            break
+        params["cursor"]=next_cursor
+
+    if max_results:
+        works=works[:max_results]
+
+    if watermark is not None:
+        works=[w for w in works if is_new_work(watermark,w)]
+        advance_watermark(watermark,works)
+
+    return works
+
+def is_new_work(watermark,work):
+    """
+    False for works an earlier run already settled
+    """
+    last_date=watermark.get("publication_date")
+    source_id=work["id"].split("/")[-1]
+    if not last_date or source_id in watermark.get("pending",{}):
+        return True
+    date=work.get("publication_date") or ""
+    if date<last_date:
+        return False
+    return date>last_date or source_id not in watermark.get("seen_ids",[])
+
+def advance_watermark(watermark,works):
+    """
+    Move the watermark to the newest publication_date in works, keeping the
+    ids already seen on that day, and mark the works pending. Future dates
+    are ignored so a single mis-dated work cannot hide the rest of the
+    window.
+    """
+    today=datetime.today().strftime("%Y-%m-%d")
+    for work in works:
+        date=work.get("publication_date")
+        if not date or date>today:
+            continue
+        if date>watermark.get("publication_date",""):
+            watermark["publication_date"]=date
+            watermark["seen_ids"]=[]
+        source_id=work["id"].split("/")[-1]
+        watermark.setdefault("pending",{})[source_id]=date
+        if date==watermark["publication_date"]:
+            if source_id not in watermark["seen_ids"]:
+                watermark["seen_ids"].append(source_id)
+
+def settle_work(watermark,source_id):
+    """
+    The work was stored or rejected for good, later runs need not list it again.
+    Works that failed to download (or have no PDF yet) stay pending.
+    """
+    if watermark is not None:
+        watermark.get("pending",{}).pop(source_id,None)
+
+def load_watermarks(file_path,path=WATERMARKS_PATH):
+    """
+    Per-concept watermarks of the previous run for one metadata file
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path,"r",encoding="utf-8") as f:
+        return json.load(f).get(file_path,{})
+
+def save_watermarks(file_path,watermarks,path=WATERMARKS_PATH):
+    all_watermarks={}
+    if os.path.exists(path):
+        with open(path,"r",encoding="utf-8") as f:
+            all_watermarks=json.load(f)
+    all_watermarks[file_path]=watermarks
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path+".tmp","w",encoding="utf-8") as f:
+        json.dump(all_watermarks,f,ensure_ascii=False,indent=2)
+    os.replace(path+".tmp",path)
+
+def load_previous_papers(file_path,out_dir,recent_days=None):
+    """
+    Papers of the previous manifest that are still in the window and on disk
+    """
+    path=f"data/processed/{file_path}"
+    if not os.path.exists(path):
+        return None
+    with open(path,"r",encoding="utf-8") as f:
+        papers=json.load(f)
+
+    date_limit=""
+    if recent_days:
+        date_limit = (datetime.today() - timedelta(days=recent_days)).strftime("%Y-%m-%d")
+    return [
+        p for p in papers
+        if (p.get("date_published") or "")>date_limit
+        and os.path.exists(os.path.join(out_dir,p["source_id"]+".pdf"))
+    ]
+
+def manifest_order(papers):
+    """
+    Concepts in config order, newest first within a concept. A resumed or
+    incremental run then writes the same manifest as a clean one.
+    """
+    rank={}
+    for i,item in enumerate(config["concepts"]):
+        rank.setdefault(item["domain"],i)
+    papers=sorted(papers,key=lambda p:(p.get("date_published") or "",p["source_id"]),reverse=True)
+    return sorted(papers,key=lambda p:rank.get(p["domain"],len(rank)))
+
+def build_metadata(paper,domain):
+    return {
+        "source_id": paper["id"].split("/")[-1],
+        "title": paper["display_name"],
+        "doi": paper.get("doi"),
+        "date_published": paper.get("publication_date"),
+        "citation_count": paper.get("cited_by_count"),
+        "authors": [a["author"]["display_name"] for a in paper.get("authorships", [])],
+        "domain": domain,
+        "name":safe_name(paper["display_name"])
+    }
+
+def resolve_pdf_url(paper):
+    """
+    Try 3 methods only - fast and effective.
+    The outcome is cached per work id, "no PDF" only when every lookup
+    gave a definitive answer.
+    """
+    source_id = paper["id"].split("/")[-1]
+    hit, pdf_url = pdf_cache.get_resolution(source_id)
+    if hit:
+        return pdf_url
+
+    _resolution.inconclusive = False
+    pdf_url = find_best_pdf_url(paper)
+    if not pdf_url:
+        pdf_url = get_arxiv_link(paper)
+        if not pdf_url:
+            pdf_url = get_semantic_scholar_pdf(paper)
+
+    if pdf_url or not _resolution.inconclusive:
+        pdf_cache.set_resolution(source_id, pdf_url)
+    return pdf_url
+
+def resolve_and_download(paper,source_id,out_dir="data/raw"):
+    """
+    Find a PDF for the work and download it, returns True if it was saved
+    """
+    if pdf_store.has_source(source_id):
+        pdf_store.materialize(source_id, out_dir)
+        return True
+
+    pdf_url = resolve_pdf_url(paper)
+    if not pdf_url:
+        return False
+    return download_pdf(pdf_url, source_id,out_dir=out_dir) == "saved"
+
+def fetch_paper_by_concept(id,domain,minimum_citations=400,max_results=None,recent_days=None,out_dir="data/raw",watermark=None,journal=None):
+
     papers=[]
-    response=requests.get(base_url,params=params).json()
-    response_results=response["results"]
     # print(f"Found {len(response_results)} papers for {domain}")
 
-    for paper in response.get("results", []):
-        if paper["id"] in papers_ids:
+    for paper in fetch_concept_works(id,minimum_citations,max_results,recent_days,watermark):
+        metadata = build_metadata(paper,domain)
+        if metadata["source_id"] in papers_ids:
+            settle_work(watermark,metadata["source_id"])
             continue
-             
-        source_id=paper["id"].split("/")[-1]
-        metadata = {
-            "source_id": source_id,
-            "title": paper["display_name"],
-            "doi": paper.get("doi"),
-            "date_published": paper.get("publication_date"),
-            "citation_count": paper.get("cited_by_count"),
-            "authors": [a["author"]["display_name"] for a in paper.get("authorships", [])],
-            "domain": domain,
-            "name":safe_name(paper["display_name"])
-        }
-        
-        
 
-        if is_primary_concept(paper,id):
-            
-            
-            pdf_url = None
-            
-            # Try 3 methods only - fast and effective
-            
-            pdf_url = find_best_pdf_url(paper)
-            if not pdf_url:
-                pdf_url = get_arxiv_link(paper)
-                if not pdf_url:
-                    pdf_url = get_semantic_scholar_pdf(paper)
-                    
-            
-            if pdf_url:
-                download_result = download_pdf(pdf_url, metadata["source_id"],out_dir=out_dir)
-                if download_result == "saved":
-                    papers_ids.add(metadata["source_id"])
-                    papers.append(metadata)
+        if not is_primary_concept(paper,id):
+            settle_work(watermark,metadata["source_id"])
+        else:
+            if resolve_and_download(paper,metadata["source_id"],out_dir=out_dir):
+                settle_work(watermark,metadata["source_id"])
+                papers_ids.add(metadata["source_id"])
+                papers.append(metadata)
+                if journal is not None:
+                    journal.add_paper(metadata)
                 
     print(f"\n📊 {domain}: {len(papers)} papers collected")
     return papers
 
+def fetch_papers_concurrently(concepts,minimum_citations=5000,max_results=30,recent_days=None,out_dir="data/raw",workers=8,watermarks=None,journal=None):
+    """
+    Same result as calling fetch_paper_by_concept for every concept in order,
+    but PDF resolution and downloads for all concepts run on a thread pool.
+    Each source_id is downloaded by one task that tries its candidates in
+    config order until one is saved, and the paper is attributed to that
+    concept, like the serial path retrying it under later concepts.
+    """
+
+    def download_first(source_id,tries):
+        # position of the candidate that was saved, or None
+        for position,(paper,metadata) in enumerate(tries):
+            try:
+                saved=resolve_and_download(paper,source_id,out_dir)
+            except Exception as e:
+                print(f"⚠️ Failed to fetch {source_id}: {e}")
+                saved=False
+            if saved:
+                if journal is not None:
+                    journal.add_paper(metadata)
+                return position
+        return None
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        listings=list(pool.map(
+            lambda item: fetch_concept_works(
+                item["id"],minimum_citations,max_results,recent_days,
+                watermarks.setdefault(item["id"],{}) if watermarks is not None else None
+            ),
+            concepts
+        ))
+
+        # 1. Candidates in the same order the serial path would visit them
+        candidates=[]
+        tries={}
+        for item,works in zip(concepts,listings):
+            watermark=watermarks.get(item["id"]) if watermarks is not None else None
+            for paper in works:
+                metadata=build_metadata(paper,item["domain"])
+                source_id=metadata["source_id"]
+                if source_id in papers_ids or not is_primary_concept(paper,item["id"]):
+                    settle_work(watermark,source_id)
+                    continue
+                tries.setdefault(source_id,[]).append((paper,metadata))
+                candidates.append((item["domain"],metadata,watermark,len(tries[source_id])-1))
+
+        # 2. Download, one task per work
+        to_download={source_id:pool.submit(download_first,source_id,work_tries) for source_id,work_tries in tries.items()}
+        saved={}
+        for source_id,future in tqdm(to_download.items(),total=len(to_download)):
+            saved[source_id]=future.result()
+
+    # 3. Dedupe through papers_ids in serial order
+    papers_by_domain={item["domain"]:[] for item in concepts}
+    for domain,metadata,watermark,position in candidates:
+        source_id=metadata["source_id"]
+        winner=saved[source_id]
+        # candidates before the saved one failed and stay pending
+        if winner is None or position<winner:
+            continue
+        settle_work(watermark,source_id)
+        if position>winner:
+            continue
+        with papers_ids_lock:
+            if source_id in papers_ids:
+                continue
+            papers_ids.add(source_id)
+        papers_by_domain[domain].append(metadata)
+
+    all_papers=[]
+    for item in concepts:
+        domain_papers=papers_by_domain[item["domain"]]
+        print(f"\n📊 {item['domain']}: {len(domain_papers)} papers collected")
+        all_papers.extend(domain_papers)
+    return all_papers
+
 def fetch_recent_papers(days_back=7,number_of_citations=0):
-    fetch_all_papers(minimum_citations=number_of_citations,max_results=50,recent_days=days_back,file_path="metadata_recent.json",out_dir="data/raw_recent")
+    fetch_all_papers(minimum_citations=number_of_citations,max_results=None,recent_days=days_back,file_path="metadata_recent.json",out_dir="data/raw_recent",incremental=True)
+
+def fetch_all_papers(minimum_citations=5000,max_results=30,file_path="metadata.json",recent_days=None,out_dir="data/raw",workers=None,incremental=False):
+    """
+    Every accepted paper is appended to data/processed/<name>.journal.jsonl
+    as soon as its PDF is saved. If the previous run did not finish, this
+    run resumes from its journal instead of starting over.
 
-def fetch_all_papers(minimum_citations=5000,max_results=30,file_path="metadata.json",recent_days=None,out_dir="data/raw"):
+    With incremental=True only works newer than the per-concept watermark of
+    the previous run are fetched, and they are merged into the previous
+    manifest (minus papers that left the recent_days window).
+    """
     all_papers=[]
     concepts=config["concepts"]
+    if workers is None:
+        workers=ingestion_config.get("workers",1)
+
+    metadata_path=f"data/processed/{file_path}"
+    journal_file=journal_path(metadata_path)
+    state=read_journal(journal_file)
+    resume=os.path.exists(journal_file) and not state["complete"]
+
+    watermarks=None
+    if resume:
+        print(f"↩️ Resuming from {journal_file}: {len(state['papers'])} papers already fetched")
+        all_papers=state["papers"]
+        concepts=[c for c in concepts if c["id"] not in state["done_concepts"]]
+        if incremental:
+            watermarks=state["watermarks"] or {}
+        journal=MetadataJournal(journal_file,resume=True)
+    else:
+        if incremental:
+            previous_papers=load_previous_papers(file_path,out_dir,recent_days)
+            # Without the previous manifest the watermarks would skip its papers
+            watermarks=load_watermarks(file_path) if previous_papers is not None else {}
+            all_papers=previous_papers or []
+        journal=MetadataJournal(journal_file)
+        journal.start(watermarks)
+        for paper in all_papers:
+            journal.add_paper(paper)
+    papers_ids.update(p["source_id"] for p in all_papers)
 
-    for item in tqdm(concepts):
-        id=item["id"]
-        domain=item["domain"]
-        domain_papers=fetch_paper_by_concept(id=id,domain=domain,minimum_citations=minimum_citations,max_results=max_results,recent_days=recent_days,out_dir=out_dir)
-        all_papers.extend(domain_papers)
+    try:
+        if workers>1:
+            all_papers+=fetch_papers_concurrently(concepts,minimum_citations=minimum_citations,max_results=max_results,recent_days=recent_days,out_dir=out_dir,workers=workers,watermarks=watermarks,journal=journal)
+            for item in concepts:
+                journal.concept_done(item["id"])
+        else:
+            for item in tqdm(concepts):
+                id=item["id"]
+                domain=item["domain"]
+                watermark=watermarks.setdefault(id,{}) if watermarks is not None else None
+                domain_papers=fetch_paper_by_concept(id=id,domain=domain,minimum_citations=minimum_citations,max_results=max_results,recent_days=recent_days,out_dir=out_dir,watermark=watermark,journal=journal)
+                all_papers.extend(domain_papers)
+                journal.concept_done(id)
+    finally:
+        # Keep what was learned about URLs even if the run dies
+        pdf_cache.save_cache()
+        pdf_store.save_index()
 
     os.makedirs("data/processed", exist_ok=True)
-    with open(f"data/processed/{file_path}", "w", encoding="utf-8") as f:
-        json.dump(all_papers, f, ensure_ascii=False, indent=2)
+    with open(metadata_path+".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest_order(all_papers), f, ensure_ascii=False, indent=2)
+    os.replace(metadata_path+".tmp",metadata_path)
+
+    if watermarks is not None:
+        save_watermarks(file_path,watermarks)
+
+    journal.complete()
+    journal.close()
 
     
 
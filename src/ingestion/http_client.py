@@ -0,0 +1,138 @@
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+import requests
+import yaml
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+with open("config.yaml","r") as f:
+    config=yaml.safe_load(f)
+
+ingestion_config=config.get("ingestion",{})
+http_config=ingestion_config.get("http",{})
+
+USER_AGENT='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket, `rate` requests per second with bursts up to `capacity`
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = max(capacity, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Reserve the token now and sleep outside the lock
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+
+
+_session=None
+_session_lock=threading.Lock()
+
+_buckets={}
+_host_slots={}
+_hosts_lock=threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """
+    One pooled session shared by the whole ingestion module, with jittered
+    retries on 429/5xx (Retry-After is respected)
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(
+                total=http_config.get("retries", 3),
+                backoff_factor=http_config.get("backoff_factor", 0.5),
+                backoff_jitter=http_config.get("backoff_jitter", 0.5),
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=frozenset(["HEAD", "GET"]),
+                respect_retry_after_header=True,
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(
+                pool_connections=http_config.get("pool_connections", 32),
+                pool_maxsize=max(http_config.get("pool_maxsize", 16), ingestion_config.get("workers", 1)),
+                max_retries=retry,
+            )
+            session = requests.Session()
+            session.headers["User-Agent"] = USER_AGENT
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+
+def _host(url):
+    return urlparse(url).netloc.lower()
+
+
+def throttle(url):
+    """
+    Wait for the per-host rate limit configured under ingestion.http.rate_limits
+    """
+    host=_host(url)
+    rate=http_config.get("rate_limits",{}).get(host)
+    if not rate:
+        return
+    with _hosts_lock:
+        if host not in _buckets:
+            _buckets[host]=TokenBucket(rate, capacity=rate)
+        bucket=_buckets[host]
+    bucket.acquire()
+
+
+@contextmanager
+def host_slot(url):
+    """
+    Limit how many requests run at the same time against one host
+    """
+    host=_host(url)
+    with _hosts_lock:
+        if host not in _host_slots:
+            _host_slots[host]=threading.BoundedSemaphore(ingestion_config.get("per_host_concurrency",4))
+        slot=_host_slots[host]
+    with slot:
+        yield
+
+
+def request(method, url, **kwargs) -> requests.Response:
+    with host_slot(url):
+        throttle(url)
+        return get_session().request(method, url, **kwargs)
+
+
+def head(url, **kwargs) -> requests.Response:
+    kwargs.setdefault("allow_redirects", True)
+    return request("HEAD", url, **kwargs)
+
+
+def get(url, **kwargs) -> requests.Response:
+    return request("GET", url, **kwargs)
+
+
+@contextmanager
+def stream(url, **kwargs):
+    """
+    Streaming GET that keeps the host slot until the body has been read
+    """
+    with host_slot(url):
+        throttle(url)
+        with get_session().get(url, stream=True, **kwargs) as r:
+            yield r
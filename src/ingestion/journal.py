@@ -0,0 +1,118 @@
+import json
+import os
+import threading
+
+
+def journal_path(metadata_path):
+    """
+    data/processed/metadata.json -> data/processed/metadata.journal.jsonl
+    """
+    root, _ = os.path.splitext(metadata_path)
+    return root + ".journal.jsonl"
+
+
+def _read_lines(path):
+    with open(path,"r",encoding="utf-8") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # torn last line of a run that was killed mid-write
+                continue
+
+
+def truncate_torn_tail(path):
+    """
+    Cut a partial last line off, so the next entry is not appended onto it
+    """
+    if not os.path.exists(path):
+        return
+    with open(path,"rb+") as f:
+        end=f.seek(0,os.SEEK_END)
+        while end>0:
+            start=max(end-4096,0)
+            f.seek(start)
+            newline=f.read(end-start).rfind(b"\n")
+            if newline!=-1:
+                f.truncate(start+newline+1)
+                return
+            end=start
+        f.truncate(0)
+
+
+def read_journal(path):
+    """
+    Replay a journal into {"papers", "done_concepts", "complete", "watermarks"},
+    watermarks being the ones the journaled run started from
+    """
+    state={"papers": [], "done_concepts": set(), "complete": False, "watermarks": None}
+    if not os.path.exists(path):
+        return state
+
+    seen=set()
+    for entry in _read_lines(path):
+        event=entry.get("event")
+        if event=="start":
+            state["watermarks"]=entry.get("watermarks")
+        elif event=="concept_done":
+            state["done_concepts"].add(entry["concept"])
+        elif event=="complete":
+            state["complete"]=True
+        elif event is None and entry["source_id"] not in seen:
+            seen.add(entry["source_id"])
+            state["papers"].append(entry)
+    return state
+
+
+def is_complete(path):
+    """
+    True once the journaled run wrote its manifest
+    """
+    return any(entry.get("event")=="complete" for entry in _read_lines(path))
+
+
+def iter_journal_papers(path):
+    """
+    Stream the papers of a journal, finished or not
+    """
+    seen=set()
+    for entry in _read_lines(path):
+        if entry.get("event") is None and entry["source_id"] not in seen:
+            seen.add(entry["source_id"])
+            yield entry
+
+
+class MetadataJournal:
+    """
+    Append-only JSONL log of accepted papers, written as soon as each PDF is
+    saved so an interrupted fetch can resume where it stopped
+    """
+
+    def __init__(self, path, resume=False):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()
+        if resume:
+            truncate_torn_tail(path)
+        self.f = open(path, "a" if resume else "w", encoding="utf-8")
+
+    def _write(self, entry):
+        with self.lock:
+            self.f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self.f.flush()
+            os.fsync(self.f.fileno())
+
+    def start(self, watermarks=None):
+        self._write({"event": "start", "watermarks": watermarks})
+
+    def add_paper(self, metadata):
+        self._write(metadata)
+
+    def concept_done(self, concept_id):
+        self._write({"event": "concept_done", "concept": concept_id})
+
+    def complete(self):
+        self._write({"event": "complete"})
+
+    def close(self):
+        self.f.close()
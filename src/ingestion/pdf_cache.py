@@ -0,0 +1,129 @@
+import json
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+import yaml
+
+with open("config.yaml","r") as f:
+    config=yaml.safe_load(f)
+
+cache_config=config.get("ingestion",{}).get("pdf_cache",{})
+
+CACHE_PATH="data/cache/pdf_resolution.json"
+DAY=24*60*60
+
+_cache=None
+_lock=threading.Lock()
+
+
+def _empty_cache():
+    # works:    source_id -> {"url": str | None, "ts": float}
+    # probes:   url -> {"ok": bool, "ts": float}
+    # patterns: host or host/first-path-segment -> {"ok": int, "fail": int, "ts": float}
+    return {"works": {}, "probes": {}, "patterns": {}}
+
+
+def load_cache(path=CACHE_PATH):
+    global _cache
+    with _lock:
+        if _cache is None:
+            _cache=_empty_cache()
+            if os.path.exists(path):
+                try:
+                    with open(path,"r",encoding="utf-8") as f:
+                        _cache.update(json.load(f))
+                except Exception as e:
+                    print(f"⚠️ Ignoring unreadable PDF cache {path}: {e}")
+        return _cache
+
+
+def save_cache(path=CACHE_PATH):
+    cache=load_cache(path)
+    with _lock:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path+".tmp","w",encoding="utf-8") as f:
+            json.dump(cache,f,ensure_ascii=False)
+        os.replace(path+".tmp",path)
+
+
+def _expired(entry,ttl_days):
+    return time.time()-entry["ts"]>ttl_days*DAY
+
+
+def get_resolution(source_id):
+    """
+    Returns (hit, pdf_url). A hit with pdf_url None means no PDF was found
+    recently, so the work should not be probed again before the TTL ends.
+    """
+    cache=load_cache()
+    with _lock:
+        entry=cache["works"].get(source_id)
+        if entry is None:
+            return False, None
+        ttl=cache_config.get("found_ttl_days",30) if entry["url"] else cache_config.get("not_found_ttl_days",3)
+        if _expired(entry,ttl):
+            del cache["works"][source_id]
+            return False, None
+        return True, entry["url"]
+
+
+def set_resolution(source_id,pdf_url):
+    cache=load_cache()
+    with _lock:
+        cache["works"][source_id]={"url":pdf_url,"ts":time.time()}
+
+
+def _patterns(url):
+    parsed=urlparse(url)
+    host=parsed.netloc.lower()
+    segment=parsed.path.strip("/").split("/")[0]
+    return [host, f"{host}/{segment}"] if segment else [host]
+
+
+def get_probe(url):
+    """
+    Cached is_pdf_url outcome for this exact URL, or None
+    """
+    cache=load_cache()
+    with _lock:
+        entry=cache["probes"].get(url)
+        if entry is None or _expired(entry,cache_config.get("probe_ttl_days",7)):
+            return None
+        return entry["ok"]
+
+
+def is_known_bad(url):
+    """
+    True when the host (or host + first path segment) has failed every
+    probe so far, at least bad_pattern_failures times
+    """
+    cache=load_cache()
+    min_failures=cache_config.get("bad_pattern_failures",5)
+    with _lock:
+        for pattern in _patterns(url):
+            stats=cache["patterns"].get(pattern)
+            if stats is None or _expired(stats,cache_config.get("probe_ttl_days",7)):
+                continue
+            if stats["ok"]==0 and stats["fail"]>=min_failures:
+                return True
+    return False
+
+
+def record_probe(url,ok):
+    """
+    Store a definitive probe outcome, transport errors must not reach here
+    or one network hiccup would mark good hosts as bad
+    """
+    cache=load_cache()
+    now=time.time()
+    with _lock:
+        cache["probes"][url]={"ok":ok,"ts":now}
+        for pattern in _patterns(url):
+            stats=cache["patterns"].get(pattern)
+            if stats is None or _expired(stats,cache_config.get("probe_ttl_days",7)):
+                stats={"ok":0,"fail":0,"ts":now}
+                cache["patterns"][pattern]=stats
+            stats["ok" if ok else "fail"]+=1
+            stats["ts"]=now
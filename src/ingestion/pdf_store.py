@@ -0,0 +1,117 @@
+import json
+import os
+import shutil
+import threading
+import uuid
+
+STORE_DIR="data/pdf_store"
+INDEX_PATH=os.path.join(STORE_DIR,"index.json")
+
+_index=None
+_lock=threading.Lock()
+
+
+def load_index(path=INDEX_PATH):
+    # sources: source_id -> sha256
+    # urls:    url -> {"sha256": str, "etag": str | None, "last_modified": str | None}
+    global _index
+    with _lock:
+        if _index is None:
+            _index={"sources": {}, "urls": {}}
+            if os.path.exists(path):
+                try:
+                    with open(path,"r",encoding="utf-8") as f:
+                        _index.update(json.load(f))
+                except Exception as e:
+                    print(f"⚠️ Ignoring unreadable PDF store index {path}: {e}")
+        return _index
+
+
+def save_index(path=INDEX_PATH):
+    index=load_index(path)
+    with _lock:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path+".tmp","w",encoding="utf-8") as f:
+            json.dump(index,f,ensure_ascii=False)
+        os.replace(path+".tmp",path)
+
+
+def object_path(sha256):
+    return os.path.join(STORE_DIR,"objects",sha256[:2],sha256+".pdf")
+
+
+def temp_path():
+    os.makedirs(os.path.join(STORE_DIR,"tmp"), exist_ok=True)
+    return os.path.join(STORE_DIR,"tmp",uuid.uuid4().hex+".part")
+
+
+def has_source(source_id):
+    index=load_index()
+    with _lock:
+        sha256=index["sources"].get(source_id)
+    return sha256 is not None and os.path.exists(object_path(sha256))
+
+
+def conditional_headers(url):
+    """
+    If-None-Match / If-Modified-Since for a URL whose PDF is already stored
+    """
+    index=load_index()
+    with _lock:
+        entry=index["urls"].get(url)
+    if entry is None or not os.path.exists(object_path(entry["sha256"])):
+        return {}
+    headers={}
+    if entry.get("etag"):
+        headers["If-None-Match"]=entry["etag"]
+    if entry.get("last_modified"):
+        headers["If-Modified-Since"]=entry["last_modified"]
+    return headers
+
+
+def link_url(source_id,url):
+    """
+    The server answered 304, reuse the object already stored for the URL
+    """
+    index=load_index()
+    with _lock:
+        index["sources"][source_id]=index["urls"][url]["sha256"]
+
+
+def add_file(tmp_path,sha256,source_id,url,etag=None,last_modified=None):
+    """
+    Move a finished download into the store, identical bytes are kept once
+    """
+    path=object_path(sha256)
+    if os.path.exists(path):
+        os.remove(tmp_path)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path,path)
+
+    index=load_index()
+    with _lock:
+        index["sources"][source_id]=sha256
+        index["urls"][url]={"sha256":sha256,"etag":etag,"last_modified":last_modified}
+
+
+def materialize(source_id,out_dir):
+    """
+    Expose the stored PDF as <out_dir>/<source_id>.pdf (hard link, copy as fallback)
+    """
+    index=load_index()
+    with _lock:
+        sha256=index["sources"][source_id]
+    src=object_path(sha256)
+
+    os.makedirs(out_dir, exist_ok=True)
+    dst=os.path.join(out_dir,source_id+".pdf")
+    if os.path.exists(dst):
+        if os.path.samefile(src,dst):
+            return dst
+        os.remove(dst)
+    try:
+        os.link(src,dst)
+    except OSError:
+        shutil.copyfile(src,dst)
+    return dst
@@ -1,19 +1,23 @@
 import os
 import json
-from typing import List
-from PyPDF2 import PdfReader
-import nltk
 import fitz
 from tqdm import tqdm
 import re 
+import yaml
+import hashlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
-from nltk.tokenize import sent_tokenize
+from src.ingestion.journal import journal_path, iter_journal_papers, is_complete
+from src.ingestion.chunker import chunk_spans, truncate_text, CHUNK_MAX_TOKENS, CHUNK_OVERLAP, CHUNKER_VERSION, EMBEDDING_MODEL
+from src.ingestion import chunk_store
+from src.ingestion.chunk_store import ChunkStore, ChunkStoreWriter
 
-try:
-    nltk.data.find('tokenizers/punkt_tab')
-except LookupError:
-    print("📥 Downloading required NLTK data...")
-    nltk.download('punkt_tab', quiet=True)
+with open("config.yaml","r") as f:
+    config=yaml.safe_load(f)
+
+preprocess_config=config.get("preprocess",{})
 
 
 def load_metadata(path="data/processed/metadata.json"):
@@ -21,24 +25,40 @@ def load_metadata(path="data/processed/metadata.json"):
         return json.load(f)
 
 
+def iter_metadata(path="data/processed/metadata.json"):
+    """
+    Stream papers from the fetch journal next to the manifest while its run
+    is still going or was interrupted, otherwise from the manifest itself,
+    whose order does not depend on download timing
+    """
+    journal_file=journal_path(path)
+    if os.path.exists(journal_file) and not is_complete(journal_file):
+        yield from iter_journal_papers(journal_file)
+    else:
+        yield from load_metadata(path)
+
+
 
 
 
-def extract_abstract(pdf_path: str, max_chars_if_not_found: int = 2000) -> str:
+# Bump when extraction output changes so cached chunks get rebuilt
+EXTRACTOR_VERSION="pymupdf-single-pass-1"
+
+# The abstract is looked for on the first pages only
+ABSTRACT_PAGES=2
+
+# iter_paper_chunks marker for a paper copied as is from the previous store
+REUSED=object()
+
+
+def find_abstract(text: str, max_chars_if_not_found: int = 2000) -> str:
     """
-    Extract the abstract (or as close as possible) from a scientific PDF.
+    Extract the abstract (or as close as possible) from the text of a scientific PDF.
 
     - Tries to capture text after 'Abstract' until the next common heading.
     - If no obvious heading is found, returns up to max_chars_if_not_found chars.
     """
-    # -------- 1) Read entire text -----------
-    doc = fitz.open(pdf_path)
-    full_text = ""
-    for page in doc:
-        full_text += page.get_text("text") + "\n"
-    doc.close()
-
-    # -------- 2) Common section headings that usually follow the abstract ------
+    # -------- 1) Common section headings that usually follow the abstract ------
     # Add or remove depending on the papers you have
     next_headings = [
         "introduction", "background", "related work", "preliminaries",
@@ -49,15 +69,15 @@ def extract_abstract(pdf_path: str, max_chars_if_not_found: int = 2000) -> str:
     # Build a single regex group with all these possibilities
     stop_pattern = "|".join(re.escape(h) for h in next_headings)
 
-    # -------- 3) Regex to capture Abstract section ----------------------------
+    # -------- 2) Regex to capture Abstract section ----------------------------
     # (?is) = case-insensitive + dot matches newlines
     pattern = re.compile(rf"(?is)abstract[:\s]*(.*?)(?=\n\s*(?:{stop_pattern}))")
-    m = pattern.search(full_text)
+    m = pattern.search(text)
     if m:
         abstract = m.group(1).strip()
     else:
         # Fallback: just grab some text after the first occurrence of 'abstract'
-        m2 = re.search(r"(?is)abstract[:\s]*(.*)", full_text)
+        m2 = re.search(r"(?is)abstract[:\s]*(.*)", text)
         if m2:
             abstract = m2.group(1).strip()
             # truncate if too long
@@ -65,38 +85,36 @@ def extract_abstract(pdf_path: str, max_chars_if_not_found: int = 2000) -> str:
         else:
             abstract = ""
 
-    # -------- 4) Clean up spacing --------------------------------------------
+    # -------- 3) Clean up spacing --------------------------------------------
     abstract = re.sub(r"\s+", " ", abstract)
     return abstract
 
 
+def extract_pdf(pdf_path: str, max_chars_if_not_found: int = 2000, abstract_pages: int = ABSTRACT_PAGES):
+    """
+    Open the PDF once with PyMuPDF and stream its pages.
+    Returns (abstract, full_text); the abstract only looks at the first pages.
+    """
+    pages = []
+    try:
+        with fitz.open(pdf_path) as doc:
+            for page in doc:
+                pages.append(page.get_text("text"))
+    except Exception:
+        return "", ""
 
+    head = "\n".join(pages[:abstract_pages]) + "\n"
+    return find_abstract(head, max_chars_if_not_found), "\n".join(p for p in pages if p)
 
 
-
-
-
-
-
-
-
+def extract_abstract(pdf_path: str, max_chars_if_not_found: int = 2000) -> str:
+    abstract, _ = extract_pdf(pdf_path, max_chars_if_not_found)
+    return abstract
 
 
 def extract_text_from_pdf(pdf_path):
-
-    try:
-        reader=PdfReader(pdf_path)
-
-        text=[]
-
-        for page in reader.pages:
-            content=page.extract_text()
-            if content:
-                text.append(content)
-            
-        return "\n".join(text)
-    except Exception as e:
-        return ""
+    _, text = extract_pdf(pdf_path)
+    return text
 
 
 def clean_text(text: str) -> str:
@@ -105,7 +123,25 @@ def clean_text(text: str) -> str:
     return text.strip()
 
 
+def sent_tokenize(text):
+    """
+    NLTK sentence splitting, only the baseline chunker needs it so punkt is
+    fetched on first use rather than at import in every worker
+    """
+    import nltk
+    try:
+        nltk.data.find('tokenizers/punkt_tab')
+    except LookupError:
+        print("📥 Downloading required NLTK data...")
+        nltk.download('punkt_tab', quiet=True)
+    return nltk.tokenize.sent_tokenize(text)
+
+
 def chunk_text_with_overlap(text: str, max_tokens: int = 350, overlap: int = 50):
+    """
+    Previous whitespace-word chunker, superseded by chunker.chunk_text and
+    kept as the baseline of benchmark_chunker
+    """
     sentences = sent_tokenize(text)
     chunks, current_chunk, token_count = [], [], 0
 
@@ -129,79 +165,187 @@ def chunk_text_with_overlap(text: str, max_tokens: int = 350, overlap: int = 50)
 
 
 
-def process_pdfs(metadata_path,data_path,out_path):
+def process_paper(metadata,data_path):
+    """
+    Extract, clean and chunk one paper.
+    Returns its chunks as (text, chunk_index, is_abstract, n_tokens), the
+    title + abstract first. Runs in a worker process; a broken PDF only
+    loses this paper.
+    """
+    pdf_path=os.path.join(data_path,metadata["source_id"]+".pdf")
 
-    pdfs_metadata=load_metadata(metadata_path)
+    if not os.path.exists(pdf_path):
+        return []
 
+    try:
+        abstract_text, raw_text = extract_pdf(pdf_path, max_chars_if_not_found=2000)
 
-    all_chunks = []
-    x=0
-    for metadata in tqdm(pdfs_metadata):
-        x+=1
+        cleaned_text=clean_text(raw_text)
         
-        pdf_path=os.path.join(data_path,metadata["source_id"]+".pdf")
 
-        if not os.path.exists(pdf_path):
-            continue
+        spans=chunk_spans(cleaned_text,CHUNK_MAX_TOKENS,CHUNK_OVERLAP)
+    except Exception as e:
+        print(f"⚠️ Failed to process {pdf_path}: {e}")
+        return []
 
-        abstract_text = extract_abstract(pdf_path, max_chars_if_not_found=2000)
-        
-        raw_text=extract_text_from_pdf(pdf_path)
+    if not spans:
+        return []
 
-        cleaned_text=clean_text(raw_text)
-        
+    # one chunk per paper, cut to what the embedding model reads
+    abstract_chunk, abstract_tokens = truncate_text(metadata["title"]+ abstract_text, CHUNK_MAX_TOKENS)
+    chunks=[(abstract_chunk, 0, True, abstract_tokens)]
+    for i, (start, end, n_tokens) in enumerate(spans):
+        chunks.append((cleaned_text[start:end], i+1, False, n_tokens))
+    return chunks
 
-        chunked_text=chunk_text_with_overlap(cleaned_text,350,50)
-
-        for i, chunk in enumerate(chunked_text):
-
-
-            if i==0:
-                entry_id = f"{metadata['source_id']}_chunk_0"
-
-                entry = {
-                "id":entry_id,
-                "source_id": metadata["source_id"],
-                "domain": metadata["domain"],
-                "citation_count": metadata["citation_count"],
-                "date_published": metadata["date_published"],
-                "chunk_index": 0,
-                "text_chunk": metadata["title"]+ abstract_text,
-                "metadata": {
-                    "title": metadata["title"],
-                    "authors": metadata["authors"],
-                    "doi": metadata["doi"],
-                },
-                "is_abstract": True
-                }
-                all_chunks.append(entry)
-            entry_id = f"{metadata['source_id']}_chunk_{i+1}"
-
-            entry = {
-                "id":entry_id,
-                "source_id": metadata["source_id"],
-                "domain": metadata["domain"],
-                "citation_count": metadata["citation_count"],
-                "date_published": metadata["date_published"],
-                "chunk_index": i+1,
-                "text_chunk": chunk,
-                "metadata": {
-                    "title": metadata["title"],
-                    "authors": metadata["authors"],
-                    "doi": metadata["doi"],
-                },
-                "is_abstract": False
-            }
-            all_chunks.append(entry)
-
-    with open(out_path, "w", encoding="utf-8") as f:
-        for entry in all_chunks:
-            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
 
-    
+def process_papers_in_pool(tasks,data_path,workers):
+    """
+    tasks are (metadata, ready) pairs, ready being a result that is already
+    known (e.g. reused chunks) or None. Yields (metadata, result) in task
+    order while up to 2*workers papers are processed ahead on a process pool.
+
+    If a worker dies (e.g. MuPDF crashing on a corrupt file) every paper in
+    flight fails with it, so the head paper is retried alone: if it breaks
+    the pool again it is the culprit and is skipped, otherwise the rest is
+    resubmitted.
+    """
+    def submit(pool,metadata):
+        try:
+            return pool.submit(process_paper,metadata,data_path)
+        except BrokenProcessPool:
+            return None
+
+    def result(future):
+        try:
+            return future.result() if future is not None else None
+        except BrokenProcessPool:
+            return None
+
+    pool=ProcessPoolExecutor(max_workers=workers)
+    pending=deque()
+    tasks=iter(tasks)
+    try:
+        while True:
+            while len(pending)<2*workers:
+                task=next(tasks,None)
+                if task is None:
+                    break
+                metadata,ready=task
+                pending.append((metadata,ready,submit(pool,metadata) if ready is None else None))
+            if not pending:
+                break
+
+            metadata,ready,future=pending.popleft()
+            if ready is not None:
+                yield metadata,ready
+                continue
+            entries=result(future)
+            if entries is not None:
+                yield metadata,entries
+                continue
+
+            pool.shutdown(wait=False,cancel_futures=True)
+            pool=ProcessPoolExecutor(max_workers=workers)
+            entries=result(submit(pool,metadata))
+            if entries is None:
+                print(f"⚠️ Skipping {metadata['source_id']}: it crashed the PDF worker")
+                pool.shutdown(wait=False,cancel_futures=True)
+                pool=ProcessPoolExecutor(max_workers=workers)
+                entries=[]
+            pending=deque((m,r,submit(pool,m) if r is None else None) for m,r,_ in pending)
+            yield metadata,entries
+    finally:
+        pool.shutdown(wait=False,cancel_futures=True)
+
+
+def file_sha256(path):
+    digest=hashlib.sha256()
+    with open(path,"rb") as f:
+        for block in iter(lambda: f.read(1024*1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def paper_fingerprint(metadata,pdf_path):
+    """
+    Everything the chunks of a paper depend on: PDF bytes, extractor,
+    chunking parameters and the metadata copied into the paper table
+    """
+    inputs={
+        "pdf_sha256": file_sha256(pdf_path),
+        "extractor_version": EXTRACTOR_VERSION,
+        "chunker_version": CHUNKER_VERSION,
+        "tokenizer": EMBEDDING_MODEL,
+        "max_tokens": CHUNK_MAX_TOKENS,
+        "overlap": CHUNK_OVERLAP,
+        "metadata": {k: metadata.get(k) for k in ("title","authors","doi","domain","citation_count","date_published")},
+    }
+    return hashlib.sha256(json.dumps(inputs,sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def iter_paper_chunks(metadata_path,data_path,old_store=None,workers=None):
+    """
+    Generator over (metadata, fingerprint, chunks) for every paper in
+    metadata order. chunks is REUSED when old_store already holds the paper
+    with the same fingerprint, otherwise the list returned by process_paper.
+    Only the papers currently in flight are held in memory.
+    """
+    if workers is None:
+        workers=preprocess_config.get("workers") or os.cpu_count() or 1
+
+    fingerprints={}
+    counts={"reused":0,"processed":0}
+
+    def tasks():
+        for metadata in iter_metadata(metadata_path):
+            pdf_path=os.path.join(data_path,metadata["source_id"]+".pdf")
+            if not os.path.exists(pdf_path):
+                continue
+
+            fingerprint=paper_fingerprint(metadata,pdf_path)
+            fingerprints[metadata["source_id"]]=fingerprint
+            if (old_store is not None and metadata["source_id"] in old_store.paper_index
+                    and old_store.paper(metadata["source_id"])["fingerprint"]==fingerprint):
+                counts["reused"]+=1
+                yield metadata,REUSED
+            else:
+                counts["processed"]+=1
+                yield metadata,None
+
+    if workers>1:
+        results=process_papers_in_pool(tasks(),data_path,workers)
+    else:
+        results=((m,r if r is not None else process_paper(m,data_path)) for m,r in tasks())
+
+    for metadata,chunks in tqdm(results):
+        yield metadata,fingerprints.get(metadata["source_id"]),chunks
+
+    print(f"♻️ {counts['reused']} papers reused, {counts['processed']} processed")
 
-        
 
+def process_pdfs(metadata_path,data_path,out_path,workers=None):
+    """
+    Build the chunk store at out_path. Papers whose fingerprint did not
+    change are copied from the previous store instead of being parsed again.
+    The new store replaces the old one only once every paper is written.
+    """
+    old_store=ChunkStore(out_path) if chunk_store.exists(out_path) else None
+    writer=ChunkStoreWriter(out_path)
+    try:
+        for metadata,fingerprint,chunks in iter_paper_chunks(metadata_path,data_path,old_store,workers):
+            if chunks is REUSED:
+                writer.copy_paper(old_store,metadata["source_id"],metadata,fingerprint)
+            # papers without chunks are retried next time
+            elif chunks:
+                writer.add_paper(metadata,chunks,fingerprint)
+    except BaseException:
+        writer.abort()
+        raise
+    finally:
+        if old_store is not None:
+            old_store.close()
+    writer.commit()
 
 
 
@@ -209,10 +353,10 @@ def preprocess_papers(kind=[True,True]):
     
     if kind[0]:
         print("preprocessing important papers")
-        process_pdfs("data/processed/metadata.json","data/raw","data/processed/chunks.jsonl")
+        process_pdfs("data/processed/metadata.json","data/raw","data/processed/chunks")
     if kind[1]:
         print("preprocessing recent papers")
-        process_pdfs("data/processed/metadata_recent.json","data/raw_recent","data/processed/chunks_recent.jsonl")
+        process_pdfs("data/processed/metadata_recent.json","data/raw_recent","data/processed/chunks_recent")
 
 
 
@@ -0,0 +1,39 @@
+"""
+Directories that are rebuilt as a whole (chunk stores, the quantized and
+BM25 indexes): written to <path>.tmp, then swapped in place of path. The
+directory is complete once its meta.json exists, which is written last.
+"""
+import json
+import os
+import shutil
+
+
+def start(path):
+    """
+    Empty <path>.tmp to write the new directory into
+    """
+    tmp_path = path + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    return tmp_path
+
+
+def commit(tmp_path, path, meta):
+    """
+    Write meta.json into tmp_path and move it to path, the previous
+    directory is set aside until the new one is in place
+    """
+    # written last, a directory without meta.json is incomplete
+    with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+
+    old_path = path + ".old"
+    shutil.rmtree(old_path, ignore_errors=True)
+    if os.path.exists(path):
+        os.rename(path, old_path)
+    os.rename(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+
+def abort(tmp_path):
+    shutil.rmtree(tmp_path, ignore_errors=True)
@@ -0,0 +1,174 @@
+# src/langgraph_workflow/answer_cache.py
+"""
+Semantic cache of final answers. A turn is looked up right after intent
+classification: entries must match exactly on intent and domains, and the
+normalized query embedding must be within the similarity threshold.
+Follow-up intents also match on what they depend on, specific_paper on the
+paper and the conversation context, latest_papers on the period. A hit
+skips retrieval and generation, the classification call is still paid.
+
+Entries are dropped when store_embedding refreshes the index, latest_papers
+answers also at the end of the day.
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from datetime import date
+from typing import Dict, Any
+
+import numpy as np
+import yaml
+
+from src.vector_db.embedding_backend import embed_query, normalize_query
+from src.vector_db.query_embeddings import index_version
+
+with open("config.yaml","r") as f:
+    config=yaml.safe_load(f)
+
+answer_cache_config=config.get("answer_cache",{})
+ENABLED=answer_cache_config.get("enabled",True)
+# cosine between query embeddings above which a cached answer is reused
+SIMILARITY_THRESHOLD=answer_cache_config.get("similarity_threshold",0.95)
+MAX_ENTRIES=answer_cache_config.get("max_entries",512)
+
+
+class AnswerCache:
+    def __init__(self, threshold=SIMILARITY_THRESHOLD, max_entries=MAX_ENTRIES):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        # exact key -> OrderedDict(query text -> (unit vector, entry)), least recently used first
+        self.groups = {}
+        self.order = OrderedDict()
+        self.version = None
+        self.hits = self.misses = self.stores = 0
+
+    def _check_version(self):
+        version = index_version()
+        if version != self.version:
+            self.groups.clear()
+            self.order.clear()
+            self.version = version
+
+    def lookup(self, key, vector):
+        with self.lock:
+            self._check_version()
+            today = date.today().isoformat()
+            best, best_score = None, self.threshold
+            for query, (cached, entry) in self.groups.get(key, {}).items():
+                if entry.get("day", today) != today:
+                    continue
+                score = float(cached @ vector)
+                if score >= best_score:
+                    best, best_score = query, score
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.order.move_to_end((key, best))
+            return self.groups[key][best][1]
+
+    def store(self, key, query, vector, entry):
+        with self.lock:
+            self._check_version()
+            self.groups.setdefault(key, {})[query] = (vector, entry)
+            self.order[(key, query)] = None
+            self.order.move_to_end((key, query))
+            self.stores += 1
+            while len(self.order) > self.max_entries:
+                old_key, old_query = self.order.popitem(last=False)[0]
+                del self.groups[old_key][old_query]
+                if not self.groups[old_key]:
+                    del self.groups[old_key]
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "stores": self.stores,
+                    "entries": len(self.order), "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+answer_cache = AnswerCache()
+
+
+def cache_key(state: Dict[str, Any]):
+    """
+    Exact part of the key: intent and domains, plus the paper and the
+    conversation context for specific_paper and the period for latest_papers
+    """
+    info = state["intent_info"]
+    key = {"intent": info.intent, "domains": sorted(info.domains)}
+    if info.intent == "specific_paper":
+        key["paper"] = [info.specific_paper, info.specific_paper_id]
+        key["context"] = [m["content"] for m in state.get("chat_history", [])[-3:-1]]
+    elif info.intent == "latest_papers":
+        key["period"] = info.period
+    return hashlib.sha1(json.dumps(key, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def query_vector(query):
+    vector = np.asarray(embed_query(query), dtype=np.float32)
+    return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+
+def answer_cache_lookup_node(state: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Runs after intent_classifier: answers from the cache on a hit
+    (state["cache_hit"]), otherwise leaves the key for cached_node
+    """
+    state["cache_hit"] = False
+    state["answer_cache_key"] = None
+    # a classification that fell back after an error is not cached either way
+    if not ENABLED or state.get("error"):
+        return state
+
+    query = normalize_query(state["chat_history"][-1]["content"])
+    try:
+        key = cache_key(state)
+        entry = answer_cache.lookup(key, query_vector(query))
+    except Exception as e:
+        print(f"⚠️ Answer cache lookup failed: {e}")
+        return state
+
+    state["answer_cache_key"] = key
+    if entry is None:
+        return state
+
+    state["cache_hit"] = True
+    # the cached turn's intent, with the paper paper_determiner resolved for follow-ups
+    state["intent_info"] = entry["intent_info"].model_copy(deep=True)
+    state["chat_history"].append({"role": "assistant", "content": entry["answer"]})
+    return state
+
+
+def cached_node(node):
+    """
+    Wrap a terminal node so its answer is stored under the key of the lookup
+    """
+    def wrapper(state: Dict[str, Any]) -> Dict[str, Any]:
+        history_length = len(state["chat_history"])
+        state = node(state)
+        key = state.get("answer_cache_key")
+        history = state["chat_history"]
+        # failed turns (state["error"]) are not worth repeating
+        if key is None or state.get("error") or len(history) <= history_length or history[-1]["role"] != "assistant":
+            return state
+        try:
+            query = normalize_query(history[history_length - 1]["content"])
+            info = state["intent_info"]
+            entry = {"answer": history[-1]["content"], "intent_info": info.model_copy(deep=True)}
+            if info.intent == "latest_papers":
+                # "the last N days" moves with the calendar
+                entry["day"] = date.today().isoformat()
+            answer_cache.store(key, query, query_vector(query), entry)
+        except Exception as e:
+            print(f"⚠️ Answer cache store failed: {e}")
+        return state
+
+    wrapper.__name__ = getattr(node, "__name__", "cached_node")
+    return wrapper
+
+
+def stats():
+    return answer_cache.stats()
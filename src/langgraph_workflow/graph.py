@@ -7,6 +7,7 @@ from src.langgraph_workflow.intent_classifier import IntentInfo
 from src.langgraph_workflow.paper_details import paper_details_node,paper_determining_node
 from src.langgraph_workflow.fallback_responder import fallback_responder_node
 from src.langgraph_workflow.topic_qa import topic_qa_node
+from src.langgraph_workflow.answer_cache import answer_cache_lookup_node, cached_node
 
 class State(TypedDict):
     query: Optional[str]
@@ -15,6 +16,9 @@ class State(TypedDict):
     chat_history: List[Dict[str, str]]   # [{"role":"user","content":...}, ...]
     last_bot_response: Optional[str]
     papers_retrieved: List[Dict[str, Any]]   
+    cache_hit: Optional[bool]
+    answer_cache_key: Optional[str]
+    error: Optional[str]
 
 
 
@@ -22,24 +26,28 @@ def create_graph():
     graph = StateGraph(State)          # StateGraph(State) is used to create the graph
 
     graph.add_node("intent_classifier", intent_classifier_node)
-    graph.add_node("abstract_formatter", abstract_formatter_node)
+    graph.add_node("abstract_formatter", cached_node(abstract_formatter_node))
     graph.add_node("paper_determiner", paper_determining_node)
-    graph.add_node("fallback_responder", fallback_responder_node)
-    graph.add_node("topic_retriever",topic_qa_node)
-    graph.add_node("paper_details",paper_details_node)
+    graph.add_node("fallback_responder", cached_node(fallback_responder_node))
+    graph.add_node("topic_retriever",cached_node(topic_qa_node))
+    graph.add_node("paper_details",cached_node(paper_details_node))
 
     graph.add_node("period_trend_retriever", period_trend_retriever_node)
 
+    # the cache is keyed on the intent, a hit skips retrieval and generation
+    graph.add_node("answer_cache", answer_cache_lookup_node)
     graph.add_edge(START, "intent_classifier")
+    graph.add_edge("intent_classifier", "answer_cache")
 
     graph.add_edge("fallback_responder", END)
     graph.add_edge("period_trend_retriever", "abstract_formatter")
     graph.add_edge("abstract_formatter", END)
 
     graph.add_conditional_edges(
-        "intent_classifier",
-        lambda state: state["intent_info"].intent,  # Dictionary access
+        "answer_cache",
+        lambda state: "cached" if state.get("cache_hit") else state["intent_info"].intent,  # Dictionary access
         {
+            "cached": END,
             "latest_papers": "period_trend_retriever",
             "topic_qa": "topic_retriever",
             "specific_paper": "paper_determiner",
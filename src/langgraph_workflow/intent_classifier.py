@@ -27,6 +27,8 @@ def intent_classifier_node(state: Dict[str, Any], llm=None) -> Dict[str, Any]:
     """
 
     # print(" we are classifying intent ")
+    # errors of the previous turn
+    state["error"] = None
     if llm is None:
         llm = init_model()
 
@@ -82,6 +84,8 @@ Query:
     except Exception:
         # print("here is the exception")
         intent_info = IntentInfo(intent="out_of_scope", domains=[], period=None, specific_paper=None)
+        # the fallback answer is not an answer to this query, keep it out of the answer cache
+        state["error"] = "Intent classification failed."
 
     # Safety check  s
     # print(intent_info.intent)
@@ -1,6 +1,6 @@
 from typing import Dict, Any, List
 from src.vector_db.query_embeddings import query_embeddings
-from src.vector_db.query_embeddings import get_chunks_by_source_id_and_query
+from src.vector_db.query_embeddings import get_chunks_by_source_id_and_query, use_hybrid
 from langchain_groq import ChatGroq
 from langchain.prompts import ChatPromptTemplate
 from pydantic import BaseModel, Field
@@ -88,7 +88,7 @@ def paper_details_node(state: Dict[str, Any]) -> Dict[str, Any]:
     
     
     
-    chunks = get_chunks_by_source_id_and_query(info.specific_paper_id,query_text=state["chat_history"][-1]["content"],n_results=4)
+    chunks = get_chunks_by_source_id_and_query(info.specific_paper_id,query_text=state["chat_history"][-1]["content"],n_results=4,hybrid=use_hybrid("paper_details"))
     
     paper_text = "\n\n".join(chunks["documents"][0])
 
@@ -1,7 +1,7 @@
 from typing import Dict, Any, List
 from langchain_groq import ChatGroq
 from langchain.prompts import ChatPromptTemplate
-from src.vector_db.query_embeddings import query_embeddings
+from src.vector_db.query_embeddings import query_embeddings, use_hybrid
 
 
 
@@ -22,7 +22,7 @@ def topic_qa_node(state: Dict[str, Any]) -> Dict[str, Any]:
     # Retrieve top 5 most similar chunks (adjust k as needed)
     query=state["chat_history"][-1]["content"]
     history=state["chat_history"][-3:-1]
-    results = query_embeddings(query,n_results=5)
+    results = query_embeddings(query,n_results=5,hybrid=use_hybrid("topic_qa"))
 
     retrieved_chunks: List[str] = []
     for doc, meta in zip(results["documents"][0], results["metadatas"][0]):
@@ -64,6 +64,7 @@ If the information is not available, say you don't know.
         answer = response.content
     except Exception:
         answer = "Sorry, I couldn't generate an answer."
+        state["error"] = "LLM call failed."
 
     # Update state
     state["chat_history"].append({"role":"assistant","content":answer.strip()})
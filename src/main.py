@@ -1,44 +1,32 @@
 from src.langgraph_workflow.graph import create_graph
-import os
-import json
-from datetime import datetime, timedelta
-from src.vector_db.query_embeddings import remove_old_papers
+from datetime import datetime
 from src.vector_db.store_embedding import store_papers_embedding
+from src.vector_db.query_embeddings import warm_up
+from src.langgraph_workflow import answer_cache
 from src.ingestion.fetch_openalex import fetch_papers
 from src.ingestion.preprocess import preprocess_papers
+from src.ingestion.dedupe import dedupe_chunks
+from src.ingestion import chunk_store
+
+
+
+def main():
+    compiled_graph = create_graph()
+
+    kind = [True, True]
+
+    # ---- 1️⃣ Check for the base chunk store ----
+    if chunk_store.exists("data/processed/chunks"):
+        kind[0] = False
+
+    # ---- 2️⃣ Check for recent chunks freshness ----
+    recent_path = "data/processed/chunks_recent"
+
+    if chunk_store.exists(recent_path):
+        try:
+            # Latest date is kept in the store's meta.json
+            last_date_str = chunk_store.read_latest_date(recent_path)
 
-compiled_graph = create_graph()
-
-import os
-import json
-from datetime import datetime, timedelta
-
-import os
-import json
-from datetime import datetime, timedelta
-
-kind = [True, True]
-
-# ---- 1️⃣ Check for the base chunks file ----
-if os.path.exists("data/processed/chunks.jsonl"):
-    kind[0] = False
-
-# ---- 2️⃣ Check for recent chunks freshness ----
-recent_path = "data/processed/chunks_recent.jsonl"
-metadata_recent_path = "data/processed/metadata_recent.json"
-
-if os.path.exists(recent_path):
-    try:
-        # Load the last line (most recent entry)
-        with open(recent_path, "r", encoding="utf-8") as f:
-            last_line = None
-            for line in f:
-                last_line = line.strip()
-        
-        if last_line:
-            data = json.loads(last_line)
-            last_date_str = data.get("date_published")
-            
             if last_date_str:
                 last_date = datetime.strptime(last_date_str, "%Y-%m-%d").date()
                 today = datetime.now().date()
@@ -48,67 +36,77 @@ if os.path.exists(recent_path):
                 if days_since_last > 3:
                     # print("it's")
                     kind[1] = True
-                    # Remove old files
-                    os.remove(recent_path)
-                    if os.path.exists(metadata_recent_path):
-                        os.remove(metadata_recent_path)
-                    remove_old_papers()
-                    
+                    # metadata_recent.json and the recent chunk store are kept
+                    # so the refresh only fetches and parses what is new, and
+                    # store_papers_embedding only writes the chunks that changed
+
                 else:
                     kind[1] = False
-    except Exception as e:
-        print(f"⚠️ Error checking recency: {e}")
+        except Exception as e:
+            print(f"⚠️ Error checking recency: {e}")
+            kind[1] = True
+    else:
         kind[1] = True
-else:
-    kind[1] = True
 
-print("kind =", kind)
+    print("kind =", kind)
+
+
+
 
+    if kind[0] or kind[1]:
 
+        fetch_papers(kind)
+        preprocess_papers(kind)
+        dedupe_chunks()
+        store_papers_embedding([True,True])
 
 
-if kind[0] or kind[1]:
 
-    fetch_papers(kind)
-    preprocess_papers(kind)
-    store_papers_embedding([True,True])
 
 
 
 
+    # Open the vector DB and load the query model once, not on the first turn
+    warm_up()
 
+    # --- 1️⃣ First user prompt
+    query = input("Enter your prompt:\n").strip()
 
+    state = {
+        "query":query,
+        "chat_history": [{"role": "user", "content": query}],
+        "intent_info": None,
+        "period_papers": [],
+        "last_bot_response": None
+    }
 
-# --- 1️⃣ First user prompt
-query = input("Enter your prompt:\n").strip()
+    # --- 2️⃣ Conversation loop
+    while True:
+        # Call the graph with the current state
+        output = compiled_graph.invoke(state)
 
-state = {
-    "query":query,
-    "chat_history": [{"role": "user", "content": query}],
-    "intent_info": None,
-    "period_papers": [],
-    "last_bot_response": None
-}
+        # Get the bot's reply (assuming graph puts bot messages in chat_history)
+        bot_reply = output["chat_history"][-1]["content"]
+        print("Bot:", bot_reply)
 
-# --- 2️⃣ Conversation loop
-while True:
-    # Call the graph with the current state
-    output = compiled_graph.invoke(state)
+        # Prepare for next round
+        next_query = input("\nEnter your next prompt (or type 'exit' to quit):\n").strip()
+        if next_query.lower() == "exit":
+            cache_stats = answer_cache.stats()
+            print(f"📊 Answer cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses")
+            break
 
-    # Get the bot's reply (assuming graph puts bot messages in chat_history)
-    bot_reply = output["chat_history"][-1]["content"]
-    print("Bot:", bot_reply)
+        # Append the user message
+        output["chat_history"].append({"role": "user", "content": next_query})
 
-    # Prepare for next round
-    next_query = input("\nEnter your next prompt (or type 'exit' to quit):\n").strip()
-    if next_query.lower() == "exit":
-        break
+        # ✅ Keep only the last 3 messages in history
+        output["chat_history"] = output["chat_history"][-3:]
 
-    # Append the user message
-    output["chat_history"].append({"role": "user", "content": next_query})
+        # The new state for the next iteration
+        state = output
 
-    # ✅ Keep only the last 3 messages in history
-    output["chat_history"] = output["chat_history"][-3:]
 
-    # The new state for the next iteration
-    state = output
+# Worker processes started with "spawn" (Windows, macOS) re-import this
+# module, the pipeline must only run in the parent
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Throughput of each embedding backend and how close its vectors are to the
+torch ones, on chunks of the existing chunk store.
+
+    python -m src.vector_db.benchmark_embedding --store data/processed/chunks --limit 2000
+"""
+import argparse
+import time
+
+import numpy as np
+
+from src.ingestion.chunk_store import ChunkStore
+from src.vector_db.embedding_backend import BACKENDS, EMBEDDING_MODEL, load_embedding_model
+
+# mean cosine to torch below which a backend should not replace it
+MIN_MEAN_COSINE=0.99
+
+
+def load_texts(store_path, limit):
+    with ChunkStore(store_path) as store:
+        rows=np.linspace(0, len(store)-1, min(limit, len(store)), dtype=np.int64) if len(store) else []
+        return [store.chunk_text(int(i)) for i in rows]
+
+
+def normalize(vectors):
+    return vectors/np.maximum(np.linalg.norm(vectors,axis=1,keepdims=True),1e-12)
+
+
+def bench(backend, texts, batch_size, repeat):
+    model=load_embedding_model(EMBEDDING_MODEL, backend)
+    model.encode(texts[:batch_size], batch_size=batch_size)  # warm-up, kept out of the timings
+    best=float("inf")
+    for _ in range(repeat):
+        start=time.perf_counter()
+        vectors=model.encode(texts, batch_size=batch_size, convert_to_numpy=True)
+        best=min(best,time.perf_counter()-start)
+    return vectors, best
+
+
+def main():
+    parser=argparse.ArgumentParser()
+    parser.add_argument("--store", default="data/processed/chunks")
+    parser.add_argument("--limit", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--repeat", type=int, default=2)
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS))
+    args=parser.parse_args()
+
+    texts=load_texts(args.store,args.limit)
+    if not texts:
+        print(f"❌ No chunks in {args.store}")
+        return
+    print(f"{len(texts)} chunks of {EMBEDDING_MODEL}")
+
+    reference=None
+    for backend in ["torch"]+[b for b in args.backends if b!="torch"]:
+        vectors,seconds=bench(backend,texts,args.batch_size,args.repeat)
+        vectors=normalize(vectors)
+        line=f"{backend:<10} {seconds:8.2f}s  {len(texts)/seconds:8.1f} chunks/s"
+        if reference is None:
+            reference=vectors
+        else:
+            cosine=np.sum(vectors*reference,axis=1)
+            # does the backend rank the same nearest neighbours as torch
+            top1=np.mean(np.argmax(vectors@reference.T-2*np.eye(len(texts)),axis=1)==np.argmax(reference@reference.T-2*np.eye(len(texts)),axis=1))
+            flag="✅" if cosine.mean()>=MIN_MEAN_COSINE else "⚠️"
+            line+=f"  cosine to torch mean {cosine.mean():.4f} min {cosine.min():.4f}  same top-1 neighbour {top1:6.1%} {flag}"
+        print(line)
+
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Recall@k and size of the quantized index modes against exact float32
+search, on the vectors of the embedding cache, or with --synthetic on
+random clustered vectors. Each query is a stored vector, its own row left
+out of the results.
+
+    python -m src.vector_db.benchmark_quantized --limit 50000 --queries 200
+    python -m src.vector_db.benchmark_quantized --synthetic 20000 --queries 100
+"""
+import argparse
+import time
+
+import numpy as np
+
+from src.vector_db.embedding_backend import embedding_key
+from src.vector_db.embedding_cache import EmbeddingCache
+from src.vector_db.quantized_index import MODES, RESCORE_VECTORS, QuantizedIndex, fit_quantizer, quantize, rescore_dtype
+
+
+def exact_top(vectors, query, k):
+    scores = vectors @ query
+    top = np.argpartition(-scores, k)[:k+1]
+    return top[np.argsort(-scores[top])]
+
+
+def cached_vectors(limit, rng):
+    cache=EmbeddingCache(embedding_key())
+    n=min(len(cache.index), limit)
+    rows=np.sort(rng.choice(len(cache.index), n, replace=False))
+    return np.asarray(cache.vectors[rows], dtype=np.float32) if n else np.zeros((0,0),np.float32)
+
+
+def synthetic_vectors(n, rng, dim=384, clusters=200):
+    """
+    Points scattered around random centres, closer to real embeddings than
+    uniform noise
+    """
+    centres=rng.normal(size=(clusters,dim))
+    return (centres[rng.integers(0,clusters,n)]+0.5*rng.normal(size=(n,dim))).astype(np.float32)
+
+
+def main():
+    parser=argparse.ArgumentParser()
+    parser.add_argument("--limit", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--rescore-factors", type=int, nargs="+", default=[1, 10])
+    parser.add_argument("--rescore-vectors", default=RESCORE_VECTORS)
+    parser.add_argument("--synthetic", type=int, default=0, help="random clustered vectors instead of the cache")
+    args=parser.parse_args()
+
+    rng=np.random.default_rng(0)
+    vectors=synthetic_vectors(args.synthetic, rng) if args.synthetic else cached_vectors(args.limit, rng)
+    n=len(vectors)
+    if n<=args.k:
+        print(f"❌ Not enough cached embeddings for {embedding_key()}, run store_embedding first")
+        return
+    vectors/=np.maximum(np.linalg.norm(vectors,axis=1,keepdims=True),1e-12)
+    queries=rng.choice(n, min(args.queries, n), replace=False)
+    truth={q: set(exact_top(vectors, vectors[q], args.k).tolist())-{q} for q in queries}
+    source="synthetic clustered" if args.synthetic else embedding_key()
+    print(f"{n} vectors of {source}, {len(queries)} queries, recall@{args.k}, {args.rescore_vectors} rescoring")
+    dtype=rescore_dtype(args.rescore_vectors)
+    full=vectors.astype(dtype) if dtype is not None else None
+    rescore_bytes=full.nbytes if full is not None else 0
+    print(f"{'float32':<8} {vectors.nbytes/1e6:8.1f} MB")
+
+    for mode in MODES:
+        try:
+            rescore_dtype(args.rescore_vectors, mode)
+        except ValueError as e:
+            print(f"{mode:<8} skipped: {e}")
+            continue
+        params=fit_quantizer(vectors, mode)
+        codes=quantize(vectors, mode, params)
+        index=QuantizedIndex(mode, codes, params, [str(i) for i in range(n)], np.zeros(n, np.int32),
+                             np.zeros(n, bool), full=full)
+        for factor in args.rescore_factors:
+            start=time.perf_counter()
+            hits=0
+            for q in queries:
+                found={row for row,_ in index.search(vectors[q], args.k+1, rescore_factor=factor)}-{q}
+                hits+=len(found & truth[q])/len(truth[q])
+            ms=(time.perf_counter()-start)*1000/len(queries)
+            print(f"{mode:<8} {codes.nbytes/1e6:8.1f} MB resident ({vectors.nbytes/codes.nbytes:4.1f}x smaller), "
+                  f"{(codes.nbytes+rescore_bytes)/1e6:6.1f} MB on disk  rescore x{factor:<3} recall {hits/len(queries):6.1%}  {ms:6.2f} ms/query")
+
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+BM25 inverted index over the indexed chunks, for exact terms the embedding
+model blurs (model, dataset and hyperparameter names). One directory:
+
+    meta.json     document count, average length, BM25 parameters
+    vocab.json    term -> term id
+    ids.json      chunk id and paper of every document row
+    offsets.npy   CSR row pointers: postings of term t are [offsets[t], offsets[t+1])
+    docs.npy, tfs.npy              posting document rows and term frequencies
+    doc_len.npy, papers.npy, is_abstract.npy   document columns
+
+Arrays are memory-mapped on load. A query reads its terms' postings and
+the document columns of the rows in them, never a full column.
+"""
+import json
+import os
+import re
+import time
+from array import array
+from collections import Counter
+
+import numpy as np
+
+from src.ingestion import staged_dir
+
+BM25_DIR="embeddings/bm25"
+K1=1.2
+B=0.75
+
+# words, keeping joined technical terms (u-net, gpt-4, resnet50, batch_size, 3.5)
+TOKEN=re.compile(r"[a-z0-9]+(?:[-_.][a-z0-9]+)*")
+STOPWORDS=frozenset("""
+a an and are as at be by for from has have in is it its of on or that the this to was were which with
+we our their they these those than then there can may also been into not but such using used based
+""".split())
+
+
+def tokenize(text):
+    """
+    Lowercased terms without stopwords. A joined term also yields its
+    concatenation and parts, so "U-Net" matches "u-net", "unet" and "net"
+    """
+    terms=[]
+    for token in TOKEN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        terms.append(token)
+        parts=re.split(r"[-_.]",token)
+        if len(parts)>1:
+            terms.append("".join(parts))
+            terms.extend(p for p in parts if p not in STOPWORDS and len(p)>1)
+    return terms
+
+
+def exists(path=BM25_DIR):
+    return os.path.exists(os.path.join(path,"meta.json"))
+
+
+def build_index(docs, path=BM25_DIR):
+    """
+    docs: iterable of (chunk_id, source_id, is_abstract, text). Written next
+    to path and swapped in at the end.
+    """
+    vocab={}
+    term_ids, doc_rows, tfs = array("i"), array("i"), array("H")
+    doc_len, papers, is_abstract = array("i"), array("i"), array("b")
+    ids, source_ids, paper_index = [], [], {}
+
+    for row,(cid,source_id,abstract,text) in enumerate(docs):
+        terms=tokenize(text)
+        for term,tf in Counter(terms).items():
+            term_ids.append(vocab.setdefault(term,len(vocab)))
+            doc_rows.append(row)
+            tfs.append(min(tf,65535))
+        doc_len.append(len(terms))
+        if source_id not in paper_index:
+            paper_index[source_id]=len(source_ids)
+            source_ids.append(source_id)
+        papers.append(paper_index[source_id])
+        is_abstract.append(bool(abstract))
+        ids.append(cid)
+
+    term_ids=np.frombuffer(term_ids,dtype=np.int32) if len(term_ids) else np.zeros(0,np.int32)
+    order=np.argsort(term_ids,kind="stable")
+    offsets=np.zeros(len(vocab)+1,dtype=np.int64)
+    np.cumsum(np.bincount(term_ids,minlength=len(vocab)),out=offsets[1:])
+    doc_len=np.array(doc_len,dtype=np.int32)
+
+    tmp_path=staged_dir.start(path)
+    np.save(os.path.join(tmp_path,"offsets.npy"),offsets)
+    np.save(os.path.join(tmp_path,"docs.npy"),np.array(doc_rows,dtype=np.int32)[order])
+    np.save(os.path.join(tmp_path,"tfs.npy"),np.array(tfs,dtype=np.uint16)[order])
+    np.save(os.path.join(tmp_path,"doc_len.npy"),doc_len)
+    np.save(os.path.join(tmp_path,"papers.npy"),np.array(papers,dtype=np.int32))
+    np.save(os.path.join(tmp_path,"is_abstract.npy"),np.array(is_abstract,dtype=bool))
+    with open(os.path.join(tmp_path,"vocab.json"),"w",encoding="utf-8") as f:
+        json.dump(vocab,f,ensure_ascii=False)
+    with open(os.path.join(tmp_path,"ids.json"),"w",encoding="utf-8") as f:
+        json.dump({"ids":ids,"source_ids":source_ids},f)
+    staged_dir.commit(tmp_path,path,{"n_docs":len(ids),"avg_len":float(doc_len.mean()) if len(doc_len) else 0.0,
+                                     "k1":K1,"b":B,"n_terms":len(vocab),"built_at":time.time()})
+    return len(ids),len(vocab)
+
+
+class BM25Index:
+    def __init__(self, path=BM25_DIR):
+        with open(os.path.join(path,"meta.json"),"r",encoding="utf-8") as f:
+            self.meta=json.load(f)
+        with open(os.path.join(path,"vocab.json"),"r",encoding="utf-8") as f:
+            self.vocab=json.load(f)
+        with open(os.path.join(path,"ids.json"),"r",encoding="utf-8") as f:
+            rows=json.load(f)
+        self.ids=rows["ids"]
+        self.paper_index={s:i for i,s in enumerate(rows["source_ids"])}
+        load=lambda name: np.load(os.path.join(path,name),mmap_mode="r")
+        self.offsets=load("offsets.npy")
+        self.docs=load("docs.npy")
+        self.tfs=load("tfs.npy")
+        self.doc_len=load("doc_len.npy")
+        self.papers=load("papers.npy")
+        self.is_abstract=load("is_abstract.npy")
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search(self, query_text, n_results=5, is_abstract=None, source_id=None):
+        """
+        [(row, score)] of the n_results best matching documents, best first
+        """
+        n_docs=self.meta["n_docs"]
+        terms=[self.vocab[t] for t in set(tokenize(query_text)) if t in self.vocab]
+        if not n_docs or not terms or (source_id is not None and source_id not in self.paper_index):
+            return []
+
+        k1,b=self.meta["k1"],self.meta["b"]
+        avg_len=max(self.meta["avg_len"],1e-6)
+        posting_rows,posting_scores=[],[]
+        for term in terms:
+            begin,end=int(self.offsets[term]),int(self.offsets[term+1])
+            rows=np.asarray(self.docs[begin:end])
+            tf=np.asarray(self.tfs[begin:end],dtype=np.float32)
+            norm=k1*(1-b+b*np.asarray(self.doc_len[rows],dtype=np.float32)/avg_len)
+            idf=np.log(1+(n_docs-len(rows)+0.5)/(len(rows)+0.5))
+            posting_rows.append(rows)
+            posting_scores.append(idf*tf*(k1+1)/(tf+norm))
+
+        # sum per document over the postings, sized by the matches, not the corpus
+        candidates,inverse=np.unique(np.concatenate(posting_rows),return_inverse=True)
+        scores=np.bincount(inverse,weights=np.concatenate(posting_scores))
+
+        keep=np.ones(len(candidates),dtype=bool)
+        if is_abstract is not None and set(is_abstract)!={True,False}:
+            keep&=np.asarray(self.is_abstract[candidates])==bool(list(is_abstract)[0])
+        if source_id is not None:
+            keep&=np.asarray(self.papers[candidates])==self.paper_index[source_id]
+        candidates,scores=candidates[keep],scores[keep]
+
+        if len(candidates)==0:
+            return []
+        k=min(n_results,len(candidates))
+        top=np.argpartition(-scores,k-1)[:k]
+        top=top[np.argsort(-scores[top])]
+        return [(int(candidates[i]),float(scores[i])) for i in top]
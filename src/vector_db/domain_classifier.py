@@ -1,10 +1,41 @@
+import hashlib
+import json
+import os
+from typing import List
+
+import numpy as np
+import yaml
 from dotenv import load_dotenv
+from pydantic import BaseModel
 from langchain_groq import ChatGroq
 from langchain.prompts import ChatPromptTemplate
+from langchain.output_parsers import PydanticOutputParser
 
 
 load_dotenv()
 
+with open("config.yaml","r") as f:
+    config=yaml.safe_load(f)
+
+classifier_config=config.get("domain_classifier",{})
+
+DOMAINS = ["NLP", "CV", "ML", "DL", "MM"]
+LABEL_CACHE_PATH="data/cache/domain_labels.json"
+
+# abstracts per request and requests in flight
+BATCH_SIZE=classifier_config.get("batch_size",20)
+MAX_CONCURRENCY=classifier_config.get("max_concurrency",4)
+MAX_WORDS=150
+
+# Nearest-centroid classifier over abstract embeddings, trained on the LLM labels
+CENTROIDS_PATH="data/cache/domain_centroids.npz"
+local_config=classifier_config.get("local",{})
+LOCAL_ENABLED=local_config.get("enabled",True)
+# LLM-labelled papers a domain needs before its centroid is used
+MIN_EXAMPLES=local_config.get("min_examples",20)
+# cosine gap between the two closest centroids below which the LLM decides
+MIN_MARGIN=local_config.get("min_margin",0.05)
+
 
 prompt = ChatPromptTemplate.from_template("""
 You are an expert researcher.
@@ -13,53 +44,271 @@ Given this research paper abstract, classify the paper into exactly one of:
 - CV (Computer Vision)
 - ML (Machine Learning other than CV/NLP)
 - DL (Deep Learning generic)
-- MM (Multimodal (CV and NLP) ) 
+- MM (Multimodal (CV and NLP) )
 
 Respond with only the category name.
-                                          
+
 Abstract:
 {abstract}
 """)
 
 
-def init_model(model="llama-3.3-70b-versatile"):
-
-    llm=ChatGroq(model=model,temperature=0.0)
-
-    return llm
+batch_prompt = ChatPromptTemplate.from_template("""
+You are an expert researcher.
+Classify each of the numbered research paper abstracts below into exactly one of:
+- NLP (Natural Language Processing)
+- CV (Computer Vision)
+- ML (Machine Learning other than CV/NLP)
+- DL (Deep Learning generic)
+- MM (Multimodal (CV and NLP) )
 
-def classify_paper(abstract):
+Return one label per abstract, using the abstract's number as id.
 
-    as_list=abstract.split(" ")
-    num_of_words=len(as_list)
+{format_instructions}
 
-    if num_of_words>150:
-        abstract=" ".join(as_list[:150])
+Abstracts:
+{abstracts}
+""")
 
 
-    
-    llm=init_model()
+class PaperLabel(BaseModel):
+    id: int
+    domain: str
 
-    prompt_value=prompt.invoke({"abstract":abstract})
+class PaperLabels(BaseModel):
+    labels: List[PaperLabel]
 
-    response=llm.invoke(prompt_value)
-    print(response.content.strip())
 
+_llm=None
 
 
-    return response.content.strip()
+def init_model(model=classifier_config.get("model","llama-3.3-70b-versatile")):
 
+    llm=ChatGroq(model=model,temperature=0.0)
 
+    return llm
 
 
+def get_model():
+    """
+    One client shared by every classification call of the process
+    """
+    global _llm
+    if _llm is None:
+        _llm=init_model()
+    return _llm
 
 
+def truncate_abstract(abstract):
+    as_list=abstract.split(" ")
+    if len(as_list)>MAX_WORDS:
+        abstract=" ".join(as_list[:MAX_WORDS])
+    return abstract
+
+
+def abstract_hash(abstract):
+    return hashlib.sha256(truncate_abstract(abstract).encode("utf-8")).hexdigest()
+
+
+def normalize_label(label):
+    label=label.strip().strip(".").upper()
+    return label if label in DOMAINS else None
+
+
+def load_label_cache(path=LABEL_CACHE_PATH):
+    """
+    {source_id: {"hash": abstract hash, "domain": label}}
+    """
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path,"r",encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        print(f"⚠️ Ignoring unreadable label cache {path}")
+        return {}
+
+
+def save_label_cache(cache,path=LABEL_CACHE_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path+".tmp","w",encoding="utf-8") as f:
+        json.dump(cache,f)
+    os.replace(path+".tmp",path)
+
+
+class DomainCentroids:
+    """
+    Per-domain sums and counts of normalized abstract embeddings, so new
+    LLM labels are added without keeping the vectors around
+    """
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+        self.sums = None
+        self.counts = np.zeros(len(DOMAINS), dtype=np.int64)
+
+    @classmethod
+    def load(cls, model_name, path=CENTROIDS_PATH):
+        centroids = cls(model_name)
+        if os.path.exists(path):
+            data = np.load(path)
+            # vectors of another embedding model are not comparable
+            if str(data["model_name"]) == model_name and list(data["domains"]) == DOMAINS:
+                centroids.sums, centroids.counts = data["sums"], data["counts"]
+        return centroids
+
+    def save(self, path=CENTROIDS_PATH):
+        if self.sums is None:
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as f:
+            np.savez(f, model_name=self.model_name, domains=np.array(DOMAINS), sums=self.sums, counts=self.counts)
+        os.replace(path + ".tmp", path)
+
+    def add(self, vector, domain):
+        if domain not in DOMAINS:
+            return
+        if self.sums is None:
+            self.sums = np.zeros((len(DOMAINS), len(vector)), dtype=np.float64)
+        i = DOMAINS.index(domain)
+        self.sums[i] += vector
+        self.counts[i] += 1
+
+    def ready(self):
+        return self.sums is not None and int((self.counts >= MIN_EXAMPLES).sum()) >= 2
+
+    def predict(self, vectors):
+        """
+        (labels, margins) for normalized vectors; only domains with
+        MIN_EXAMPLES labels take part
+        """
+        usable = np.flatnonzero(self.counts >= MIN_EXAMPLES)
+        centroids = self.sums[usable] / self.counts[usable, None]
+        centroids /= np.linalg.norm(centroids, axis=1, keepdims=True)
+        scores = vectors @ centroids.T
+        top2 = np.sort(scores, axis=1)[:, -2:]
+        labels = [DOMAINS[usable[i]] for i in scores.argmax(axis=1)]
+        return labels, top2[:, 1] - top2[:, 0]
 
 
+def classify_paper(abstract):
 
-    
+    abstract=truncate_abstract(abstract)
 
+    prompt_value=prompt.invoke({"abstract":abstract})
 
+    response=get_model().invoke(prompt_value)
 
+    return response.content.strip()
 
 
+def classify_locally(source_ids, vectors, centroids):
+    """
+    Labels of the papers the centroids are confident about
+    """
+    if not source_ids or not centroids.ready():
+        return {}
+    predicted, margins = centroids.predict(np.stack([vectors[s] for s in source_ids]))
+    return {s: label for s, label, margin in zip(source_ids, predicted, margins) if margin >= MIN_MARGIN}
+
+
+def classify_papers(abstracts, batch_size=BATCH_SIZE, max_concurrency=MAX_CONCURRENCY, cache_path=LABEL_CACHE_PATH, encode=None, model_name=None):
+    """
+    abstracts: {source_id: title + abstract}. Returns {source_id: label}.
+
+    Labels come from the persistent cache when the abstract did not change.
+    With encode (texts -> normalized embeddings of model_name) the local
+    nearest-centroid classifier labels what it is confident about; the rest
+    is packed batch_size abstracts per LLM request, with up to
+    max_concurrency requests in flight, and an abstract a batch answer
+    misses falls back to its own request. LLM labels train the centroids.
+    """
+    cache=load_label_cache(cache_path)
+    labels={}
+    todo=[]
+    for source_id,abstract in abstracts.items():
+        entry=cache.get(source_id)
+        if entry is not None and entry["hash"]==abstract_hash(abstract):
+            labels[source_id]=entry["domain"]
+        else:
+            todo.append(source_id)
+
+    centroids=None
+    vectors={}
+    local={}
+    if encode is not None and LOCAL_ENABLED:
+        centroids=DomainCentroids.load(model_name)
+        # LLM labels from earlier runs that did not reach the centroids yet
+        untrained=[s for s in labels if cache[s].get("by","llm")=="llm" and not cache[s].get("in_centroids")]
+        needed=todo+untrained
+        if needed:
+            vectors=dict(zip(needed,encode([abstracts[s] for s in needed])))
+        local=classify_locally(todo,vectors,centroids)
+        labels.update(local)
+        for source_id in local:
+            cache[source_id]={"hash":abstract_hash(abstracts[source_id]),"domain":local[source_id],"by":"centroid"}
+        todo=[s for s in todo if s not in local]
+
+    print(f"🏷️ {len(abstracts)-len(todo)-len(local)} domain labels cached, {len(local)} labelled locally, {len(todo)} sent to the LLM")
+    if not todo:
+        train_centroids(cache,labels,vectors,centroids)
+        save_label_cache(cache,cache_path)
+        return labels
+
+    parser=PydanticOutputParser(pydantic_object=PaperLabels)
+    groups=[todo[i:i+batch_size] for i in range(0,len(todo),batch_size)]
+    prompts=[
+        batch_prompt.invoke({
+            "format_instructions":parser.get_format_instructions(),
+            "abstracts":"\n\n".join(f"[{i}] {truncate_abstract(abstracts[s])}" for i,s in enumerate(group)),
+        })
+        for group in groups
+    ]
+
+    responses=get_model().batch(prompts,config={"max_concurrency":max_concurrency},return_exceptions=True)
+
+    missing=[]
+    for group,response in zip(groups,responses):
+        found={}
+        if isinstance(response,Exception):
+            print(f"⚠️ Batch classification failed: {response}")
+        else:
+            try:
+                for item in parser.parse(response.content).labels:
+                    if 0<=item.id<len(group) and normalize_label(item.domain):
+                        found[group[item.id]]=normalize_label(item.domain)
+            except Exception as e:
+                print(f"⚠️ Could not parse batch labels: {e}")
+        labels.update(found)
+        missing.extend(s for s in group if s not in found)
+
+    for source_id in missing:
+        try:
+            labels[source_id]=classify_paper(abstracts[source_id])
+        except Exception as e:
+            # left out of the cache, retried on the next run
+            print(f"⚠️ Failed to classify {source_id}: {e}")
+
+    for source_id in todo:
+        if source_id in labels:
+            cache[source_id]={"hash":abstract_hash(abstracts[source_id]),"domain":labels[source_id],"by":"llm"}
+    train_centroids(cache,labels,vectors,centroids)
+    save_label_cache(cache,cache_path)
+
+    return labels
+
+
+def train_centroids(cache, labels, vectors, centroids):
+    """
+    Add the LLM labels that have a vector to the centroids, once each
+    """
+    if centroids is None:
+        return
+    for source_id,vector in vectors.items():
+        entry=cache.get(source_id)
+        if entry is None or entry.get("by","llm")!="llm" or entry.get("in_centroids"):
+            continue
+        if normalize_label(labels.get(source_id,"")):
+            centroids.add(vector,normalize_label(labels[source_id]))
+            entry["in_centroids"]=True
+    centroids.save()
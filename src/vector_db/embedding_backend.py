@@ -0,0 +1,86 @@
+"""
+The embedding model behind both ingestion (store_embedding) and queries
+(query_embeddings), on the backend set in config.yaml:
+
+    torch       full-precision PyTorch weights
+    onnx-fp32   ONNX Runtime export of the same weights
+    onnx-int8   dynamically quantized ONNX export, fastest on CPU
+
+Vectors from different backends are close but not identical, so caches
+key on embedding_key() rather than the model name alone.
+"""
+import threading
+from functools import lru_cache
+
+import yaml
+from sentence_transformers import SentenceTransformer
+
+with open("config.yaml","r") as f:
+    config=yaml.safe_load(f)
+
+embedding_config=config.get("embedding",{})
+EMBEDDING_MODEL=embedding_config.get("model","sentence-transformers/all-MiniLM-L6-v2")
+EMBEDDING_BACKEND=embedding_config.get("backend","torch")
+# quantized export shipped in the model repo, pick the one matching the CPU (avx2, avx512, arm64)
+ONNX_INT8_FILE=embedding_config.get("onnx_int8_file","onnx/model_quint8_avx2.onnx")
+# query embeddings kept in memory, by normalized query text
+QUERY_CACHE_SIZE=embedding_config.get("query_cache_size",1024)
+
+BACKENDS={
+    "torch": {},
+    "onnx-fp32": {"backend": "onnx"},
+    "onnx-int8": {"backend": "onnx", "model_kwargs": {"file_name": ONNX_INT8_FILE}},
+}
+
+_models={}
+_models_lock=threading.Lock()
+
+
+def embedding_key(model_name=EMBEDDING_MODEL, backend=EMBEDDING_BACKEND):
+    """
+    Name of the vector space: the model, plus the backend when it is not torch
+    """
+    return model_name if backend=="torch" else f"{model_name}@{backend}"
+
+
+def load_embedding_model(model_name=EMBEDDING_MODEL, backend=EMBEDDING_BACKEND):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{backend}', expected one of {list(BACKENDS)}")
+    #print(f"🔄 Loading embedding model: {model_name} ({backend})")
+    model = SentenceTransformer(model_name, **BACKENDS[backend])
+    return model
+
+
+def get_embedding_model(model_name=EMBEDDING_MODEL, backend=EMBEDDING_BACKEND):
+    """
+    One model per (model, backend) in the process, loaded on first use
+    """
+    key=(model_name,backend)
+    with _models_lock:
+        if key not in _models:
+            _models[key]=load_embedding_model(model_name,backend)
+        return _models[key]
+
+
+def normalize_query(query_text):
+    return " ".join(query_text.split())
+
+
+@lru_cache(maxsize=QUERY_CACHE_SIZE)
+def _embed_normalized_query(query_text):
+    vector=get_embedding_model().encode([query_text],convert_to_numpy=True)[0]
+    # shared by every caller that asks the same question
+    vector.flags.writeable=False
+    return vector
+
+
+def embed_query(query_text):
+    """
+    Embedding of one query, in the same space as the stored chunks. Repeated
+    questions (same text up to whitespace) are served from an LRU cache.
+    """
+    return _embed_normalized_query(normalize_query(query_text))
+
+
+def query_cache_info():
+    return _embed_normalized_query.cache_info()
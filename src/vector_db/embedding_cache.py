@@ -0,0 +1,157 @@
+"""
+Persistent embedding cache, one directory per embedding model:
+
+    meta.json     model name and vector dimension
+    keys.bin      16-byte BLAKE2b digest of each chunk text, back to back
+    vectors.f32   float32 rows in the same order, memory-mapped on load
+
+Both files are append-only. A row only counts once its key and vector are
+both on disk, so an interrupted flush loses the tail and nothing else.
+A flush appends the new rows to the in-memory index and remaps the
+vectors, and can run while other threads read from the cache.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+
+import numpy as np
+
+CACHE_DIR="data/cache/embeddings"
+KEY_SIZE=16
+
+
+def text_key(text):
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=KEY_SIZE).digest()
+
+
+def cache_path(model_name, cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, re.sub(r"[^\w.-]+", "__", model_name))
+
+
+class EmbeddingCache:
+    def __init__(self, model_name, cache_dir=CACHE_DIR):
+        self.model_name = model_name
+        self.path = cache_path(model_name, cache_dir)
+        self.keys_path = os.path.join(self.path, "keys.bin")
+        self.vectors_path = os.path.join(self.path, "vectors.f32")
+        os.makedirs(self.path, exist_ok=True)
+
+        self.dim = None
+        meta_path = os.path.join(self.path, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                self.dim = json.load(f)["dim"]
+
+        self.index = {}
+        self.vectors = np.zeros((0, self.dim or 0), dtype=np.float32)
+        self.pending = {}
+        self.hits = self.misses = 0
+        # index, vectors and pending change together on flush
+        self.lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if self.dim is None or not os.path.exists(self.keys_path) or not os.path.exists(self.vectors_path):
+            return
+        with open(self.keys_path, "rb") as f:
+            keys = f.read()
+        n = min(len(keys) // KEY_SIZE, os.path.getsize(self.vectors_path) // (4 * self.dim))
+        self.index = {keys[i*KEY_SIZE:(i+1)*KEY_SIZE]: i for i in range(n)}
+        if n:
+            self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(n, self.dim))
+        # drop a torn tail so appends stay aligned
+        for path, size in ((self.keys_path, n * KEY_SIZE), (self.vectors_path, n * 4 * self.dim)):
+            if os.path.getsize(path) != size:
+                with open(path, "r+b") as f:
+                    f.truncate(size)
+
+    def __len__(self):
+        return len(self.index) + len(self.pending)
+
+    def get(self, key):
+        with self.lock:
+            if key in self.pending:
+                return self.pending[key]
+            i = self.index.get(key)
+            return None if i is None else self.vectors[i]
+
+    def lookup(self, texts):
+        """
+        Returns (keys, cached vectors or None per text)
+        """
+        keys = [text_key(t) for t in texts]
+        found = [self.get(k) for k in keys]
+        hit = sum(v is not None for v in found)
+        self.hits += hit
+        self.misses += len(found) - hit
+        return keys, found
+
+    def add(self, keys, vectors):
+        with self.lock:
+            for key, vector in zip(keys, vectors):
+                if key not in self.index:
+                    self.pending[key] = np.asarray(vector, dtype=np.float32)
+
+    def flush(self):
+        with self.lock:
+            keys = list(self.pending)
+            vectors = [self.pending[k] for k in keys]
+        if not keys:
+            return
+        if self.dim is None:
+            self.dim = len(vectors[0])
+            with open(os.path.join(self.path, "meta.json"), "w", encoding="utf-8") as f:
+                json.dump({"model": self.model_name, "dim": self.dim}, f)
+
+        # vectors first: a key without its vector is cut off on load
+        with open(self.vectors_path, "ab") as f:
+            np.stack(vectors).astype(np.float32).tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self.keys_path, "ab") as f:
+            f.write(b"".join(keys))
+            f.flush()
+            os.fsync(f.fileno())
+
+        # only the new rows are indexed, the file is mapped again at its new length
+        n = len(self.index)
+        mapped = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(n + len(keys), self.dim))
+        with self.lock:
+            self.vectors = mapped
+            for i, key in enumerate(keys):
+                self.index[key] = n + i
+                del self.pending[key]
+
+    def close(self):
+        self.flush()
+        self.vectors = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def encode_with_cache(model, texts, cache, **encode_kwargs):
+    """
+    model.encode for the texts the cache does not hold yet, float32 array
+    of every text's embedding in order
+    """
+    keys, found = cache.lookup(texts)
+    # first position of every missing text, repeats are encoded once
+    missing = {}
+    for i, v in enumerate(found):
+        if v is None:
+            missing.setdefault(keys[i], i)
+    if missing:
+        encoded = model.encode([texts[i] for i in missing.values()], convert_to_numpy=True, **encode_kwargs)
+        cache.add(list(missing), encoded)
+        for i, key in enumerate(keys):
+            if found[i] is None:
+                found[i] = cache.get(key)
+    if not found:
+        return np.zeros((0, cache.dim or 0), dtype=np.float32)
+    return np.stack(found).astype(np.float32, copy=False)
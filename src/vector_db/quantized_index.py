@@ -0,0 +1,216 @@
+"""
+Compact vector index next to the Chroma collection, used when
+index.vectors in config.yaml is float16, int8 or binary:
+
+    meta.json      mode, dimension, embedding key, quantizer parameters
+    ids.json       chunk id and paper of every row
+    codes.bin      the vectors at reduced precision, memory-mapped
+    rescore.bin    the same rows in float32 (index.rescore_vectors), memory-mapped
+    is_abstract.npy, papers.npy   row columns
+
+Every query scans all of codes.bin, so that is what has to stay resident:
+2x (float16), 4x (int8) or 32x (binary) smaller than float32. The best
+n_results * rescore_factor candidates are then rescored with rescore.bin,
+of which only those rows are paged in. On disk the index is therefore
+larger than the float32 vectors alone. With rescore_vectors none there is
+no rescore file and the coarse scores are final, which costs recall (binary
+recall@5 falls to roughly 0.2-0.5). Chroma keeps the documents and metadata.
+"""
+import json
+import os
+import time
+
+import numpy as np
+import yaml
+
+from src.ingestion import staged_dir
+
+with open("config.yaml","r") as f:
+    config=yaml.safe_load(f)
+
+index_config=config.get("index",{})
+# chroma keeps float32 vectors in the collection, the other modes keep them here
+INDEX_VECTORS=index_config.get("vectors","chroma")
+RESCORE_FACTOR=index_config.get("rescore_factor",10)
+RESCORE_VECTORS=index_config.get("rescore_vectors","float32")
+
+INDEX_DIR="embeddings/quantized"
+MODES=("float16","int8","binary")
+RESCORE_DTYPES={"float32": np.float32, "float16": np.float16, "none": None}
+# bits set in every byte value, for Hamming distances on packed codes
+POPCOUNT=np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+BLOCK_ROWS=32768
+
+
+def fit_quantizer(vectors, mode):
+    """
+    Parameters of the quantizer: per-dimension range for int8, none otherwise
+    """
+    if mode!="int8" or len(vectors)==0:
+        return {}
+    low=vectors.min(axis=0)
+    high=vectors.max(axis=0)
+    return {"low": low.tolist(), "scale": (np.maximum(high-low,1e-12)/255).tolist()}
+
+
+def quantize(vectors, mode, params):
+    vectors=np.asarray(vectors, dtype=np.float32)
+    if mode=="float16":
+        return vectors.astype(np.float16)
+    if mode=="int8":
+        low, scale=np.array(params["low"],np.float32), np.array(params["scale"],np.float32)
+        return (np.clip(np.rint((vectors-low)/scale),0,255)-128).astype(np.int8)
+    if mode=="binary":
+        return np.packbits(vectors>0, axis=1)
+    raise ValueError(f"Unknown quantized index mode '{mode}', expected one of {MODES}")
+
+
+def code_shape(mode, dim):
+    return (np.uint8, (dim+7)//8) if mode=="binary" else (np.float16 if mode=="float16" else np.int8, dim)
+
+
+def coarse_scores(codes, query, mode, params):
+    """
+    Scores of the codes against a float32 query, higher is closer. For int8
+    the constant offset of the dequantization is left out, it does not
+    change the ranking.
+    """
+    if mode=="float16":
+        return codes.astype(np.float32) @ query
+    if mode=="int8":
+        return codes.astype(np.float32) @ (np.array(params["scale"],np.float32)*query)
+    # binary: minus the Hamming distance of the sign bits
+    bits=np.packbits(query>0)
+    return -POPCOUNT[np.bitwise_xor(codes, bits)].sum(axis=1, dtype=np.int32).astype(np.float32)
+
+
+def rescore_dtype(rescore, mode=None):
+    if rescore not in RESCORE_DTYPES:
+        raise ValueError(f"Unknown rescore_vectors '{rescore}', expected one of {list(RESCORE_DTYPES)}")
+    if mode == "float16" and rescore == "float16":
+        raise ValueError("float16 codes rescored in float16 store the same vectors twice, use rescore_vectors float32 or none")
+    return RESCORE_DTYPES[rescore]
+
+
+class QuantizedIndex:
+    def __init__(self, mode, codes, params, ids, papers, is_abstract, full=None, source_ids=None):
+        self.mode = mode
+        self.codes = codes
+        self.params = params
+        self.ids = ids
+        self.papers = papers
+        self.is_abstract = is_abstract
+        # rescore rows, full[i] is row i, None when the coarse scores are final
+        self.full = full
+        self.source_ids = source_ids or []
+        self.paper_index = {s: i for i, s in enumerate(self.source_ids)}
+
+    @classmethod
+    def load(cls, path=INDEX_DIR):
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        with open(os.path.join(path, "ids.json"), "r", encoding="utf-8") as f:
+            rows = json.load(f)
+        dtype, width = code_shape(meta["mode"], meta["dim"])
+        n = len(rows["ids"])
+        codes = np.memmap(os.path.join(path, "codes.bin"), dtype=dtype, mode="r", shape=(n, width)) if n else np.zeros((0, width), dtype)
+
+        full = None
+        # indexes built before rescore.bin existed fail below and need a rebuild
+        dtype = rescore_dtype(meta.get("rescore", "float32"))
+        if dtype is not None and n:
+            rescore_path = os.path.join(path, "rescore.bin")
+            if not os.path.exists(rescore_path):
+                raise FileNotFoundError(f"❌ {rescore_path} is missing, rebuild the index with store_embedding")
+            full = np.memmap(rescore_path, dtype=dtype, mode="r", shape=(n, meta["dim"]))
+
+        index = cls(meta["mode"], codes, meta["params"], rows["ids"], np.load(os.path.join(path, "papers.npy")),
+                    np.load(os.path.join(path, "is_abstract.npy")), full, rows["source_ids"])
+        index.meta = meta
+        return index
+
+    def __len__(self):
+        return len(self.ids)
+
+    def candidate_rows(self, is_abstract=None, source_id=None):
+        mask = np.ones(len(self.ids), dtype=bool)
+        if is_abstract is not None and set(is_abstract) != {True, False}:
+            mask &= self.is_abstract == bool(list(is_abstract)[0])
+        if source_id is not None:
+            mask &= self.papers == self.paper_index.get(source_id, -1)
+        return np.flatnonzero(mask)
+
+    def search(self, query, n_results=5, is_abstract=None, source_id=None, rescore_factor=RESCORE_FACTOR):
+        """
+        [(row, cosine)] of the n_results best rows, best first
+        """
+        query = np.asarray(query, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        rows = self.candidate_rows(is_abstract, source_id)
+        if len(rows) == 0:
+            return []
+
+        scores = np.empty(len(rows), dtype=np.float32)
+        for begin in range(0, len(rows), BLOCK_ROWS):
+            block = rows[begin:begin + BLOCK_ROWS]
+            scores[begin:begin + len(block)] = coarse_scores(self.codes[block], query, self.mode, self.params)
+
+        k = min(len(rows), max(n_results * rescore_factor, n_results))
+        top = np.argpartition(-scores, k - 1)[:k]
+        candidates = rows[top]
+
+        if self.full is not None:
+            exact = self.full[candidates].astype(np.float32) @ query
+        else:
+            exact = scores[top]
+        order = np.argsort(-exact)[:n_results]
+        return [(int(candidates[i]), float(exact[i])) for i in order]
+
+
+def build_index(entries, vectors, mode, embedding_key, rescore=RESCORE_VECTORS, path=INDEX_DIR):
+    """
+    entries: (chunk_id, source_id, is_abstract) per row, vectors the matching
+    float32 array. Written next to path and swapped in at the end.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown quantized index mode '{mode}', expected one of {MODES}")
+    dtype = rescore_dtype(rescore, mode)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    dim = vectors.shape[1] if len(vectors) else 0
+    params = fit_quantizer(vectors, mode)
+
+    source_ids = []
+    paper_index = {}
+    papers = np.empty(len(entries), dtype=np.int32)
+    for i, (_, source_id, _) in enumerate(entries):
+        if source_id not in paper_index:
+            paper_index[source_id] = len(source_ids)
+            source_ids.append(source_id)
+        papers[i] = paper_index[source_id]
+
+    tmp_path = staged_dir.start(path)
+    with open(os.path.join(tmp_path, "codes.bin"), "wb") as f:
+        for begin in range(0, len(vectors), BLOCK_ROWS):
+            quantize(vectors[begin:begin + BLOCK_ROWS], mode, params).tofile(f)
+    if dtype is not None:
+        with open(os.path.join(tmp_path, "rescore.bin"), "wb") as f:
+            for begin in range(0, len(vectors), BLOCK_ROWS):
+                vectors[begin:begin + BLOCK_ROWS].astype(dtype).tofile(f)
+    np.save(os.path.join(tmp_path, "papers.npy"), papers)
+    np.save(os.path.join(tmp_path, "is_abstract.npy"), np.array([e[2] for e in entries], dtype=bool))
+    with open(os.path.join(tmp_path, "ids.json"), "w", encoding="utf-8") as f:
+        json.dump({"ids": [e[0] for e in entries], "source_ids": source_ids}, f)
+    staged_dir.commit(tmp_path, path, {"mode": mode, "dim": dim, "embedding_key": embedding_key, "params": params,
+                                       "rescore": rescore, "n_rows": len(entries), "built_at": time.time()})
+
+
+def index_size(path=INDEX_DIR):
+    """
+    (resident, on_disk) bytes: what every query scans (everything but the
+    rescore rows), and everything the index keeps on disk
+    """
+    if not os.path.exists(path):
+        return 0, 0
+    sizes = {f: os.path.getsize(os.path.join(path, f)) for f in os.listdir(path)}
+    on_disk = sum(sizes.values())
+    return on_disk - sizes.get("rescore.bin", 0), on_disk
@@ -1,24 +1,257 @@
 # src/vector_db/query_embeddings.py
 import os
+import json
+import threading
+import yaml
+from concurrent.futures import ThreadPoolExecutor, wait
 from chromadb import PersistentClient
 from typing import List
 from datetime import datetime, timedelta
+from src.vector_db.embedding_backend import embed_query, embedding_key
+from src.vector_db.quantized_index import QuantizedIndex, INDEX_DIR, INDEX_VECTORS
+from src.vector_db.bm25_index import BM25Index, BM25_DIR
+
+
+with open("config.yaml","r") as f:
+    config=yaml.safe_load(f)
+
+hybrid_config=config.get("retrieval",{}).get("hybrid",{})
+# graph nodes that fuse BM25 with dense retrieval
+HYBRID_NODES=set(hybrid_config.get("nodes",[]))
+# candidates taken from each retriever per requested result
+HYBRID_CANDIDATES=hybrid_config.get("candidates_per_result",4)
+RRF_K=hybrid_config.get("rrf_k",60)
+# past this the fused query returns whatever retriever finished
+HYBRID_BUDGET_MS=hybrid_config.get("budget_ms",300)
+
+
+# Touched by store_embedding whenever the indexed chunks change
+INDEX_VERSION_PATH="embeddings/index_version.json"
+
+
+def index_version(path=INDEX_VERSION_PATH):
+    """
+    Stamp of the last index refresh, None before the first one
+    """
+    try:
+        with open(path,"r",encoding="utf-8") as f:
+            return json.load(f).get("version")
+    except (OSError, ValueError):
+        return None
+
+
+# One client per database path and one handle per collection, shared by
+# every graph node and thread of the process
+_registry_lock=threading.RLock()
+_clients={}
+_collections={}
+_quantized_index=None
+_bm25_index=None
+# runs the lexical and dense halves of a hybrid query side by side
+_retrieval_pool=ThreadPoolExecutor(max_workers=4,thread_name_prefix="retrieval")
+
+
+def get_client(db_path="embeddings"):
+    with _registry_lock:
+        if db_path not in _clients:
+            if not os.path.exists(db_path):
+                raise FileNotFoundError(
+                    f"❌ Database path '{db_path}' not found. Did you run the embedding script first?"
+                )
+            _clients[db_path] = PersistentClient(path=db_path)
+        return _clients[db_path]
 
 
 def init_chroma(db_path="embeddings", collection_name="paper"):
     """
-    Connect to the persistent Chroma DB and return the collection.
+    Return the collection, connecting to the persistent Chroma DB on first use only.
+    """
+    key = (db_path, collection_name)
+    with _registry_lock:
+        if key not in _collections:
+            _collections[key] = get_client(db_path).get_collection(name=collection_name)
+        return _collections[key]
+
+
+def reopen(db_path=None):
+    """
+    Forget the open clients and collections (of db_path, or all of them) so
+    the next call connects again, e.g. after store_embedding rebuilt the
+    collection
+    """
+    global _quantized_index, _bm25_index
+    with _registry_lock:
+        for key in [k for k in _collections if db_path is None or k[0] == db_path]:
+            del _collections[key]
+        for path in [p for p in _clients if db_path is None or p == db_path]:
+            del _clients[path]
+        _quantized_index = None
+        _bm25_index = None
+
+
+def health_check(db_path="embeddings", collection_name="paper"):
+    """
+    True when the collection answers; a stale handle is reopened once
+    """
+    for attempt in range(2):
+        try:
+            init_chroma(db_path, collection_name).count()
+            return True
+        except Exception as e:
+            if attempt == 0:
+                reopen(db_path)
+            else:
+                print(f"⚠️ Vector DB health check failed: {e}")
+    return False
+
+
+def warm_up(db_path="embeddings", collection_name="paper"):
+    """
+    Open the collection and load the query embedding model (and the quantized
+    index) before the first user turn
+    """
+    if not health_check(db_path, collection_name):
+        return False
+    stored = (init_chroma(db_path, collection_name).metadata or {}).get("embedding")
+    if stored is not None and stored != embedding_key():
+        print(f"⚠️ The collection holds {stored} vectors but queries use {embedding_key()}, run store_embedding to re-embed")
+        return False
+    embed_query("warm up")
+    if INDEX_VECTORS != "chroma":
+        get_quantized_index()
+    if HYBRID_NODES and os.path.exists(os.path.join(BM25_DIR, "meta.json")):
+        get_bm25_index()
+    return True
+
+
+def get_quantized_index(path=INDEX_DIR):
+    """
+    The quantized index, reloaded when store_embedding rebuilt it
+    """
+    global _quantized_index
+    meta_path=os.path.join(path,"meta.json")
+    if not os.path.exists(meta_path):
+        raise FileNotFoundError(f"❌ Quantized index '{path}' not found. Did you run the embedding script first?")
+    with _registry_lock:
+        if _quantized_index is None or _quantized_index.built_at!=os.path.getmtime(meta_path):
+            index=QuantizedIndex.load(path)
+            index.built_at=os.path.getmtime(meta_path)
+            _quantized_index=index
+        return _quantized_index
+
+
+def get_bm25_index(path=BM25_DIR):
+    """
+    The BM25 index, reloaded when store_embedding rebuilt it
+    """
+    global _bm25_index
+    meta_path=os.path.join(path,"meta.json")
+    if not os.path.exists(meta_path):
+        raise FileNotFoundError(f"❌ BM25 index '{path}' not found. Did you run the embedding script first?")
+    with _registry_lock:
+        if _bm25_index is None or _bm25_index.built_at!=os.path.getmtime(meta_path):
+            index=BM25Index(path)
+            index.built_at=os.path.getmtime(meta_path)
+            _bm25_index=index
+        return _bm25_index
+
+
+def use_hybrid(node_name):
     """
-    if not os.path.exists(db_path):
-        raise FileNotFoundError(
-            f"❌ Database path '{db_path}' not found. Did you run the embedding script first?"
-        )
+    Whether a graph node opted in to hybrid retrieval in config.yaml
+    """
+    return node_name in HYBRID_NODES
+
 
-    client = PersistentClient(path=db_path)
-    collection = client.get_collection(name=collection_name)
-    return collection
+def lexical_search(query_text,n_results,is_abstract=None,source_id=None):
+    index=get_bm25_index()
+    return [index.ids[row] for row,_ in index.search(query_text,n_results,is_abstract=is_abstract,source_id=source_id)]
 
 
+def hybrid_search(collection,query_text,n_results,is_abstract=None,source_id=None,budget_ms=HYBRID_BUDGET_MS):
+    """
+    Dense and BM25 candidates fused with reciprocal rank fusion, in the
+    collection.query result layout. Both retrievers run concurrently; one
+    that fails or misses the latency budget is left out. Without BM25 hits
+    the dense result is awaited, and its error raised.
+    """
+    n_candidates=n_results*HYBRID_CANDIDATES
+    dense=_retrieval_pool.submit(search_collection,collection,query_text,n_candidates,is_abstract,source_id)
+    lexical=_retrieval_pool.submit(lexical_search,query_text,n_candidates,is_abstract,source_id)
+    wait([dense,lexical],timeout=budget_ms/1000)
+
+    rankings=[]
+    dense_results=None
+    lexical_ok=lexical.done() and lexical.exception() is None
+    if not (lexical_ok and lexical.result()):
+        # nothing to fall back on, wait for dense and let its error through
+        dense_results=dense.result()
+        rankings.append(dense_results["ids"][0])
+    elif not dense.done():
+        print(f"⚠️ Dense retrieval over the {budget_ms} ms budget, using BM25 only")
+    elif dense.exception() is not None:
+        print(f"⚠️ Dense retrieval failed, using BM25 only: {dense.exception()}")
+    else:
+        dense_results=dense.result()
+        rankings.append(dense_results["ids"][0])
+    if lexical_ok:
+        rankings.append(lexical.result())
+    elif lexical.done():
+        print(f"⚠️ BM25 retrieval failed, using dense only: {lexical.exception()}")
+    else:
+        print(f"⚠️ BM25 retrieval over the {budget_ms} ms budget, using dense only")
+
+    fused={}
+    for ranking in rankings:
+        for rank,cid in enumerate(ranking):
+            fused[cid]=fused.get(cid,0.0)+1/(RRF_K+rank+1)
+    ids=sorted(fused,key=fused.get,reverse=True)[:n_results]
+
+    known={}
+    if dense_results is not None:
+        for cid,doc,meta,distance in zip(dense_results["ids"][0],dense_results["documents"][0],dense_results["metadatas"][0],dense_results["distances"][0]):
+            known[cid]=(doc,meta,distance)
+    missing=[cid for cid in ids if cid not in known]
+    if missing:
+        found=collection.get(ids=missing,include=["documents","metadatas"])
+        for cid,doc,meta in zip(found["ids"],found["documents"],found["metadatas"]):
+            known[cid]=(doc,meta,None)
+    ids=[cid for cid in ids if cid in known]
+
+    return {
+        "ids":[ids],
+        "documents":[[known[cid][0] for cid in ids]],
+        "metadatas":[[known[cid][1] for cid in ids]],
+        # None for chunks only BM25 found
+        "distances":[[known[cid][2] for cid in ids]],
+        "scores":[[fused[cid] for cid in ids]],
+    }
+
+
+def search_collection(collection,query_text,n_results,is_abstract=None,source_id=None):
+    """
+    collection.query on the query embedding, answered by the quantized index
+    when index.vectors is not chroma. Same result layout either way.
+    """
+    query_vector=embed_query(query_text)
+    if INDEX_VECTORS=="chroma":
+        where={"source_id": source_id} if source_id is not None else { "is_abstract": { "$in": is_abstract} }
+        return collection.query(query_embeddings=[query_vector],n_results=n_results,where=where)
+
+    index=get_quantized_index()
+    hits=index.search(query_vector,n_results,is_abstract=is_abstract,source_id=source_id)
+    ids=[index.ids[row] for row,_ in hits]
+    found=collection.get(ids=ids,include=["documents","metadatas"]) if ids else {"ids":[],"documents":[],"metadatas":[]}
+    by_id={cid:(doc,meta) for cid,doc,meta in zip(found["ids"],found["documents"],found["metadatas"])}
+    hits=[(cid,score) for cid,(_,score) in zip(ids,hits) if cid in by_id]
+    return {
+        "ids":[[cid for cid,_ in hits]],
+        "documents":[[by_id[cid][0] for cid,_ in hits]],
+        "metadatas":[[by_id[cid][1] for cid,_ in hits]],
+        # squared L2 between unit vectors, as Chroma reports it
+        "distances":[[2-2*score for _,score in hits]],
+    }
+
 
 def get_papers_abstract(date:int,domains:List[str],db_path: str = "embeddings", collection_name: str = "paper"):
 
@@ -47,18 +280,17 @@ def get_chunks_by_source_id_and_query(
     query_text: str,
     n_results: int = 5,
     db_path: str = "embeddings",
-    collection_name: str = "paper"
+    collection_name: str = "paper",
+    hybrid: bool = False
 ) :
     """
     Retrieve chunks for a specific paper (source_id) but
     also rank/filter them semantically by the given query.
     """
     collection = init_chroma(db_path=db_path, collection_name=collection_name)
-    results = collection.query(
-        query_texts=[query_text],
-        n_results=n_results,
-        where={"source_id": source_id},   # restrict to the paper
-    )
+    # embedded by the configured backend, same space as the stored chunks
+    search = hybrid_search if hybrid else search_collection
+    results = search(collection, query_text, n_results, source_id=source_id)  # restrict to the paper
     return results
 
 
@@ -68,7 +300,8 @@ def query_embeddings(
     n_results: int = 5,
     db_path: str = "embeddings",
     collection_name: str = "paper",
-    is_abstract=[True,False]
+    is_abstract=[True,False],
+    hybrid: bool = False
 ):
     """
     Query the Chroma vector DB for the most similar chunks.
@@ -79,12 +312,9 @@ def query_embeddings(
     collection = init_chroma(db_path=db_path, collection_name=collection_name)
 
     #print(f"🔍 Searching for: {query_text}")
-    results = collection.query(
-        query_texts=[query_text],
-        n_results=n_results,
-        where={ "is_abstract": { "$in": is_abstract} }   # <-- filter here
-
-    )
+    # embedded by the configured backend, same space as the stored chunks
+    search = hybrid_search if hybrid else search_collection
+    results = search(collection, query_text, n_results, is_abstract=is_abstract)  # <-- filter here
     #print("result size is ",len(results["documents"]))
     return results
 
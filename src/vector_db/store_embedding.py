@@ -1,11 +1,39 @@
-import json
-from sentence_transformers import SentenceTransformer
 from itertools import islice
+import numpy as np
+import queue
+import threading
+from tqdm import tqdm
+import hashlib
+import json
+import shutil
 import os 
 from chromadb import PersistentClient
-from src.vector_db.domain_classifier import classify_paper
+from src.vector_db.domain_classifier import classify_papers
 from datetime import date, datetime
-
+import yaml
+from src.ingestion.chunk_store import ChunkStore
+from src.ingestion.dedupe import load_duplicates, duplicate_sources
+from src.vector_db.embedding_cache import EmbeddingCache, encode_with_cache, text_key
+from src.vector_db.quantized_index import build_index, index_size, INDEX_DIR, INDEX_VECTORS, RESCORE_VECTORS
+from src.vector_db.query_embeddings import INDEX_VERSION_PATH
+from src.vector_db import bm25_index
+from src.vector_db.embedding_backend import get_embedding_model, embedding_key, EMBEDDING_BACKEND
+
+with open("config.yaml","r") as f:
+    config=yaml.safe_load(f)
+
+embedding_config=config.get("embedding",{})
+EMBEDDING_MODEL=embedding_config.get("model","sentence-transformers/all-MiniLM-L6-v2")
+
+# rows read from a chunk store at a time
+LOAD_BATCH_SIZE=512
+# wordpieces per encode batch, chunks are up to ~256 each
+BATCH_TOKENS=embedding_config.get("batch_tokens",16384)
+MAX_BATCH_SIZE=embedding_config.get("max_batch_size",256)
+# batches waiting between the read, encode and write stages
+QUEUE_SIZE=embedding_config.get("queue_size",4)
+# encoder processes for bulk ingestion, null or 1 = encode in this process
+EMBED_WORKERS=embedding_config.get("workers")
 
 
 def date_str_to_int(date_str: str) -> int:
@@ -24,20 +52,16 @@ def date_str_to_int(date_str: str) -> int:
 
 
 
-def load_chuncks(file_path1="data/processed/chunks.jsonl",file_path2="data/processed/chunks_recent.jsonl",kind=[True,True]):
-
-    
-    if kind[0]:
-        #print(" storing chunks for important papers ")
-        with open(file_path1,"r",encoding="utf-8") as f:
-            for line in f:
-                yield json.loads(line)
-
-    if kind[1]:
-        #print(" storing chunks for recent papers ")
-        with open(file_path2,"r",encoding="utf-8") as f:
-            for line in f:
-                yield json.loads(line)
+def load_chuncks(file_path1="data/processed/chunks",file_path2="data/processed/chunks_recent",kind=[True,True],batch_size=50):
+    """
+    Stream column batches out of the chunk stores, yields (store, batch)
+    """
+    for path,wanted in ((file_path1,kind[0]),(file_path2,kind[1])):
+        if not wanted:
+            continue
+        with ChunkStore(path) as store:
+            for batch in store.iter_batches(batch_size):
+                yield store,batch
     
 def batched(iterable,batch_size=50):
 
@@ -49,71 +73,375 @@ def batched(iterable,batch_size=50):
 
 
 
-def load_embedding_model(model_name="sentence-transformers/all-MiniLM-L6-v2"):
-    #print(f"🔄 Loading embedding model: {model_name}")
-    model = SentenceTransformer(model_name)
-    return model
+def start_encode_pool(model,workers=EMBED_WORKERS):
+    """
+    SentenceTransformer multi-process pool of workers CPU processes, each
+    with its own model copy, or None to encode in this process. Every worker
+    gets an equal share of the cores so they do not oversubscribe them.
+    """
+    if not workers or workers<=1:
+        return None
+    if EMBEDDING_BACKEND!="torch":
+        # ONNX Runtime already spreads one session over the cores
+        print(f"⚠️ embedding.workers is only used with the torch backend, encoding with {EMBEDDING_BACKEND} in this process")
+        return None
+    threads=max(1,(os.cpu_count() or 1)//workers)
+    previous=os.environ.get("OMP_NUM_THREADS")
+    # read by torch when the spawned workers start
+    os.environ["OMP_NUM_THREADS"]=str(threads)
+    try:
+        print(f"🧵 Starting {workers} embedding workers, {threads} threads each")
+        return model.start_multi_process_pool(target_devices=["cpu"]*workers)
+    finally:
+        if previous is None:
+            os.environ.pop("OMP_NUM_THREADS",None)
+        else:
+            os.environ["OMP_NUM_THREADS"]=previous
+
+
+def encode_options(pool,n_texts):
+    """
+    encode() arguments for a batch of n_texts, split evenly over the pool
+    """
+    if pool is None:
+        return {"batch_size":max(n_texts,1)}
+    workers=len(pool["processes"])
+    return {"pool":pool,"chunk_size":max(1,-(-n_texts//workers))}
 
 
-def init_chroma(db_path="embeddings", collection_name="paper"):
+def init_chroma(db_path="embeddings", collection_name="paper", vectors=INDEX_VECTORS):
         
     os.makedirs(db_path, exist_ok=True)
     client = PersistentClient(path=db_path)
-    collection = client.get_or_create_collection(name=collection_name)
-    return collection
+    # "full": float32 vectors in Chroma, "sidecar": they live in the quantized index
+    layout = "full" if vectors == "chroma" else "sidecar"
+    metadata = {"vectors": layout}
+    if layout == "full":
+        # vectors of another model or backend can not be reused, nor mixed with new ones
+        metadata["embedding"] = embedding_key()
+    collection = client.get_or_create_collection(name=collection_name, metadata=metadata)
+    current = collection.metadata or {}
+    if current.get("vectors", "full") != layout:
+        print(f"♻️ index.vectors changed to {vectors}, rebuilding the collection")
+    elif current.get("embedding") != metadata.get("embedding"):
+        print(f"♻️ Embedding model changed to {embedding_key()}, rebuilding the collection")
+    else:
+        return collection
+    client.delete_collection(name=collection_name)
+    return client.create_collection(name=collection_name, metadata=metadata)
+
+
+def chroma_embeddings(embeddings):
+    """
+    What Chroma stores for a batch: the vectors, or with a quantized index a
+    one-dimensional stand-in, since the collection then only serves
+    documents and metadata
+    """
+    return embeddings if INDEX_VECTORS == "chroma" else np.ascontiguousarray(embeddings[:, :1])
+
 
+def build_quantized_index(entries,embedding_cache):
+    """
+    Rebuild the quantized index from entries, (chunk_id, text key, source_id,
+    is_abstract) of every chunk in the collection, with the cached vectors.
+    The index keeps its own copy of the rescore rows, the embedding cache is
+    not read at query time.
+    """
+    embedding_cache.flush()
+    rows=np.array([embedding_cache.index[key] for _,key,_,_ in entries],dtype=np.int64)
+    vectors=np.asarray(embedding_cache.vectors[rows]) if len(rows) else np.zeros((0,0),np.float32)
+    build_index([(cid,source_id,is_abstract) for cid,_,source_id,is_abstract in entries],
+                vectors,INDEX_VECTORS,embedding_key())
+    resident,on_disk=index_size()
+    print(f"🗜️ {INDEX_VECTORS} index of {len(entries)} chunks: {resident/1e6:.1f} MB scanned per query "
+          f"({vectors.nbytes/1e6:.1f} MB as float32), {on_disk/1e6:.1f} MB on disk with {RESCORE_VECTORS} rescore rows")
+
+
+
+def collect_abstracts(kind,duplicates,file_path1="data/processed/chunks",file_path2="data/processed/chunks_recent"):
+    """
+    {source_id: title + abstract chunk} of every paper that will be embedded
+    """
+    abstracts={}
+    for path,wanted in ((file_path1,kind[0]),(file_path2,kind[1])):
+        if not wanted:
+            continue
+        with ChunkStore(path) as store:
+            for row in np.flatnonzero(store.rows["is_abstract"]):
+                source_id=store.papers[store.rows[row]["paper"]]["source_id"]
+                if source_id not in duplicates["papers"] and source_id not in abstracts:
+                    abstracts[source_id]=store.chunk_text(row)
+    return abstracts
+
+
+def content_hash(text,metadata):
+    """
+    Hash of everything stored for a chunk, compared on refresh
+    """
+    data=json.dumps([text,metadata],sort_keys=True,ensure_ascii=False)
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+def existing_hashes(collection,page_size=5000):
+    """
+    {id: content_hash} of the chunks already in the collection
+    """
+    hashes={}
+    offset=0
+    while True:
+        page=collection.get(include=["metadatas"],limit=page_size,offset=offset)
+        for cid,metadata in zip(page["ids"],page["metadatas"]):
+            hashes[cid]=(metadata or {}).get("content_hash")
+        if len(page["ids"])<page_size:
+            return hashes
+        offset+=page_size
 
 
 def store_embedding(kind):
 
-    embedding_model=load_embedding_model()
+    # the instance the query path uses too
+    embedding_model=get_embedding_model()
 
 
     collection  =init_chroma()
-    source_to_domain={}
+    duplicates=load_duplicates()
+    embedding_cache=EmbeddingCache(embedding_key())
+    existing=existing_hashes(collection)
+    pool=start_encode_pool(embedding_model)
+    try:
+        counts=embed_stores(kind,embedding_model,collection,duplicates,embedding_cache,existing,pool)
+
+        # the stores hold the whole corpus only when both were scanned
+        if all(kind):
+            stale=[cid for cid in existing if cid not in counts["seen"]]
+            for i in range(0,len(stale),5000):
+                collection.delete(ids=stale[i:i+5000])
+            counts["deleted"]=len(stale)
+
+            if INDEX_VECTORS!="chroma":
+                build_quantized_index(counts["entries"],embedding_cache)
+            else:
+                shutil.rmtree(INDEX_DIR,ignore_errors=True)
+        elif INDEX_VECTORS!="chroma":
+            print("⚠️ Quantized index not rebuilt, it needs both chunk stores")
+    finally:
+        if pool is not None:
+            embedding_model.stop_multi_process_pool(pool)
+        embedding_cache.close()
+
+    changed=bool(counts["added"] or counts["updated"] or counts["deleted"])
+    if all(kind) and (changed or not bm25_index.exists()):
+        n_docs,n_terms=bm25_index.build_index(iter_indexed_chunks(kind,duplicates))
+        print(f"🔎 BM25 index of {n_docs} chunks, {n_terms} terms")
+    if changed:
+        write_index_version()
+
+    print(f"🔄 {counts['added']} chunks added, {counts['updated']} updated, "
+          f"{counts['unchanged']} unchanged, {counts['deleted']} deleted")
+    print(f"💾 {embedding_cache.hits} embeddings reused, {embedding_cache.misses} encoded")
+
+
+def iter_indexed_chunks(kind,duplicates):
+    """
+    (id, source_id, is_abstract, text) of every chunk in the collection,
+    skipped and kept by the same rules as iter_changed_chunks
+    """
+    seen=set()
+    for store,batch in load_chuncks(kind=kind,batch_size=LOAD_BATCH_SIZE):
+        for cid,text,paper_row,is_abstract in zip(batch["ids"],batch["texts"],batch["paper"],batch["is_abstract"]):
+            source_id=store.papers[paper_row]["source_id"]
+            if source_id in duplicates["papers"] or cid in duplicates["chunks"] or cid in seen:
+                continue
+            seen.add(cid)
+            yield cid,source_id,bool(is_abstract),text
 
-    for batch in batched(load_chuncks(kind=kind),batch_size=50):
-        ids, texts,metadatas =[],[],[]
 
+def write_index_version(path=INDEX_VERSION_PATH):
+    """
+    New stamp for caches of query results (answer cache) to notice the refresh
+    """
+    os.makedirs(os.path.dirname(path),exist_ok=True)
+    with open(path+".tmp","w",encoding="utf-8") as f:
+        json.dump({"version":datetime.now().isoformat()},f)
+    os.replace(path+".tmp",path)
 
-        paper_domain="not_abstract"
-        for i,chunk in enumerate(batch):
-            
-            chunk_id=chunk["id"]
-            source_id=chunk["source_id"]
+
+def normalize(vectors):
+    return vectors/np.maximum(np.linalg.norm(vectors,axis=1,keepdims=True),1e-12)
+
+
+def iter_changed_chunks(kind,duplicates,source_to_domain,existing,counts,embedding_cache=None):
+    """
+    Generator over (id, text, metadata, n_tokens) of the chunks that are new
+    or whose content_hash differs from the one in existing ({id: content_hash}).
+    counts["entries"] gets every chunk of the collection for the quantized
+    index; with one, unchanged chunks whose vector is not cached are
+    yielded too.
+    """
+    chunk_copies,paper_copies=duplicate_sources(duplicates)
+    for store,batch in load_chuncks(kind=kind,batch_size=LOAD_BATCH_SIZE):
+
+        for cid,text,paper_row,n_tokens,is_abstract in zip(batch["ids"],batch["texts"],batch["paper"],batch["n_tokens"],batch["is_abstract"]):
             
-            if source_id in source_to_domain:
-                    paper_domain=source_to_domain[source_id]
-            else:
-                if chunk["chunk_index"]==0:
-                    
-                    paper_domain=classify_paper(chunk["text_chunk"])
-                    source_to_domain[source_id]=paper_domain
-                
+            paper=store.papers[paper_row]
+            source_id=paper["source_id"]
+
+            # near-duplicates found by dedupe_chunks are not embedded
+            if source_id in duplicates["papers"] or cid in duplicates["chunks"]:
+                continue
+            # a paper in both stores keeps the first copy
+            if cid in counts["seen"]:
+                continue
+            paper_domain=source_to_domain.get(source_id,"not_abstract")
 
 
             metadata = {
-                "source_id": chunk["source_id"],
-                "domain": chunk["domain"],
-                "citation_count": chunk["citation_count"],
-                "date_published": chunk["date_published"],
-                "date_publushed_int":date_str_to_int(chunk["date_published"]),
-                "title": chunk["metadata"]["title"],
-                "authors": ", ".join(chunk["metadata"]["authors"]),
-                "doi": chunk["metadata"]["doi"],
+                "source_id": source_id,
+                "domain": paper["domain"],
+                "citation_count": paper["citation_count"],
+                "date_published": paper["date_published"],
+                "date_publushed_int":date_str_to_int(paper["date_published"]),
+                "title": paper["title"],
+                "authors": ", ".join(paper["authors"]),
+                "doi": paper["doi"],
                 "paper_domain":paper_domain,
-                "is_abstract":chunk["is_abstract"]
+                "is_abstract":bool(is_abstract),
+                # papers whose near-duplicate copy of this chunk was dropped
+                "also_in":", ".join(sorted(chunk_copies.get(cid,set())|paper_copies.get(source_id,set())))
             }
+            metadata["content_hash"]=content_hash(text,metadata)
+
+            counts["seen"].add(cid)
+            key=None
+            if INDEX_VECTORS!="chroma":
+                key=text_key(text)
+                counts["entries"].append((cid,key,source_id,bool(is_abstract)))
+            if cid not in existing:
+                counts["added"]+=1
+            elif existing[cid]!=metadata["content_hash"]:
+                counts["updated"]+=1
+            elif key is not None and embedding_cache is not None and embedding_cache.get(key) is None:
+                counts["updated"]+=1
+            else:
+                counts["unchanged"]+=1
+                continue
 
-            ids.append(chunk_id)
-            texts.append(chunk["text_chunk"])
-            metadatas.append(metadata)
+            yield cid,text,metadata,int(n_tokens)
 
 
-        embeddings=embedding_model.encode(texts,show_progress_bar=True,convert_to_numpy=True)
+def token_batches(chunks,max_tokens=BATCH_TOKENS,max_size=MAX_BATCH_SIZE):
+    """
+    Group chunks into batches of at most max_tokens wordpieces, so a batch of
+    short chunks is as much work as a batch of full ones
+    """
+    batch=[]
+    tokens=0
+    for chunk in chunks:
+        n_tokens=max(chunk[3],1)
+        if batch and (tokens+n_tokens>max_tokens or len(batch)>=max_size):
+            yield batch
+            batch,tokens=[],0
+        batch.append(chunk)
+        tokens+=n_tokens
+    if batch:
+        yield batch
+
+
+_DONE=object()
+
 
-        collection.upsert(ids=ids,embeddings=embeddings.tolist(),documents=texts,metadatas=metadatas)
-        #print(f"stored {len(ids)} chunks ")
+def _put(q,item,stop):
+    # gives up once another stage failed, so nothing blocks on a dead consumer
+    while not stop.is_set():
+        try:
+            q.put(item,timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _get(q,stop):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return _DONE
+
+
+def embed_stores(kind,embedding_model,collection,duplicates,embedding_cache,existing,pool=None):
+    """
+    Upsert the new and changed chunks. Three stages overlap on bounded queues:
+    a thread reads the stores and batches the chunks by token count, this
+    thread encodes (sharded over pool when there is one), and a writer
+    thread upserts into Chroma.
+    """
+    workers=len(pool["processes"]) if pool is not None else 1
+    counts={"added":0,"updated":0,"unchanged":0,"deleted":0,"seen":set(),"entries":[]}
+
+    # abstracts are embedded normalized for the local classifier, the LLM
+    # only sees the papers it is not confident about
+    source_to_domain=classify_papers(
+        collect_abstracts(kind,duplicates),
+        encode=lambda texts: normalize(encode_with_cache(embedding_model,texts,embedding_cache,**encode_options(pool,len(texts)))),
+        model_name=embedding_key(),
+    )
+
+    to_encode=queue.Queue(maxsize=QUEUE_SIZE)
+    to_write=queue.Queue(maxsize=QUEUE_SIZE)
+    stop=threading.Event()
+    errors=[]
+
+    def read():
+        try:
+            # one batch feeds every worker of the pool
+            chunks=iter_changed_chunks(kind,duplicates,source_to_domain,existing,counts,embedding_cache)
+            for batch in token_batches(chunks,BATCH_TOKENS*workers,MAX_BATCH_SIZE*workers):
+                if not _put(to_encode,batch,stop):
+                    return
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            _put(to_encode,_DONE,stop)
+
+    def write():
+        try:
+            while (item:=_get(to_write,stop)) is not _DONE:
+                ids,embeddings,texts,metadatas=item
+                # numpy goes in as is, no list of floats copy
+                collection.upsert(ids=ids,embeddings=chroma_embeddings(embeddings),documents=texts,metadatas=metadatas)
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+
+    reader=threading.Thread(target=read,name="embed-reader",daemon=True)
+    writer=threading.Thread(target=write,name="embed-writer",daemon=True)
+    reader.start()
+    writer.start()
+    progress=tqdm(total=None,unit="chunk",desc="embedding")
+    try:
+        while (batch:=_get(to_encode,stop)) is not _DONE:
+            ids,texts,metadatas,_=zip(*batch)
+            # only text the cache has not seen under this model is encoded
+            embeddings=encode_with_cache(embedding_model,list(texts),embedding_cache,**encode_options(pool,len(texts)))
+            embedding_cache.flush()
+            if not _put(to_write,(list(ids),embeddings,list(texts),list(metadatas)),stop):
+                break
+            progress.update(len(ids))
+    except BaseException as e:
+        errors.append(e)
+        stop.set()
+    finally:
+        _put(to_write,_DONE,stop)
+        reader.join()
+        writer.join()
+        progress.close()
+
+    if errors:
+        raise errors[0]
+    return counts
 
 
 